@@ -0,0 +1,82 @@
+import argparse
+import os
+import random
+import time
+
+from pdf_extraction import extract_many
+from text_cleaning import clean_text, clean_text_reference
+
+# Check that the single-pass clean_text gives the same output as the original nine-pass cleaning
+# (clean_text_reference), then compare their speed per page. Run from the repository root:
+#   python kb/benchmark_cleaning.py [--pdf-folder kb/pdfs]
+
+# (page text, expected output) pairs covering each pass and the interactions between passes
+golden = [
+    ("Moral Machines\nAuthors: Jane Doe, John Roe\nAffiliations: University of Zurich\nThe trolley problem [1] asks.",
+     "Moral Machines\nThe trolley problem  asks."),
+    ("Abstract: We study dilemmas. Keywords: ethics, AI\nWe find that people disagree.\nMain text follows.",
+     "Main text follows."),
+    ("1 Introduction\nSee www.example.org or https://ssrn.com/abstract=123 and mail jane.doe@uzh.ch.\n",
+     "1 \nSee  or  and mail ."),
+    ("Results hold [12] across samples.\nReferences\nDoe, J. (2020). Moral machines. Nature.",
+     "Results hold  across samples."),
+    ("Keywords: trolley, utilitarianism, references to Kant\nBody text.",
+     ""),
+    ("Data at https://example.org/references/data.csv, see the appendix.",
+     "Data at"),
+    ("Affiliations: ETH Zurich, Authors listed alphabetically\nFirst line of text\nSecond line",
+     "Second line"),
+    ("ABSTRACT\nThis paper reviews the literature. INTRODUCTION follows.",
+     "This paper reviews the literature.  follows."),
+    ("", ""),
+]
+
+vocabulary = ("the of moral trolley problem utility agents data model choice people dilemma "
+              "machine vehicle outcome harm judgment").split()
+triggers = ("Authors: Affiliations Keywords: Abstract References Introduction [12] [3] "
+            "http://ssrn.com/abs=1 www.example.org jane.doe@uni.edu").split()
+
+def synthetic_page(rng, n_words=600, trigger_rate=0.005):
+    words = []
+    for _ in range(n_words):
+        words.append(rng.choice(triggers) if rng.random() < trigger_rate else rng.choice(vocabulary))
+        words.append("\n" if rng.random() < 0.08 else " ")
+    return "".join(words)
+
+def check(pages):
+    for text, expected in golden:
+        assert clean_text_reference(text) == expected, (text, clean_text_reference(text))
+        assert clean_text(text) == expected, (text, clean_text(text))
+    for text in pages:
+        assert clean_text(text) == clean_text_reference(text), text
+    print(f"clean_text matches the reference on {len(golden)} golden and {len(pages)} other pages")
+
+def ms_per_page(fn, pages, repeat=3):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in pages:
+            fn(text)
+    return (time.perf_counter() - start) / (repeat * len(pages)) * 1000
+
+def benchmark(name, pages):
+    reference_ms = ms_per_page(clean_text_reference, pages)
+    single_pass_ms = ms_per_page(clean_text, pages)
+    print(f"{name:<32} reference: {reference_ms:7.4f} ms/page  single pass: {single_pass_ms:7.4f} ms/page  "
+          f"speedup: {reference_ms / single_pass_ms:5.1f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and time the PDF text cleaning.")
+    parser.add_argument("--pdf-folder", help="also check and time the pages of the PDFs in this folder")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    fuzz = [synthetic_page(rng, rng.randint(5, 300), rng.choice([0.001, 0.01, 0.05, 0.2])) for _ in range(2000)]
+    check(fuzz)
+    for trigger_rate in [0.0005, 0.005, 0.05]:
+        benchmark(f"synthetic, trigger rate {trigger_rate}", [synthetic_page(rng, trigger_rate=trigger_rate) for _ in range(200)])
+
+    if args.pdf_folder:
+        paths = [os.path.join(args.pdf_folder, file) for file in sorted(os.listdir(args.pdf_folder)) if file.endswith('.pdf')]
+        pages = [text for _, document in extract_many(paths) if document is not None for text in document]
+        check(pages)
+        benchmark(f"{len(pages)} PDF pages", pages)
@@ -0,0 +1,60 @@
+import argparse
+import time
+
+import numpy as np
+
+from embedding_backend import backends, check_parity, make_embeddings
+
+# Check each embedding backend against the reference model (torch, float32, on the CPU), then time
+# single-query encodes, which sit on the critical path of every chat turn. Run from the repository root:
+#   python kb/benchmark_embeddings.py --threads 4
+
+queries = [
+    "what is the trolley problem?",
+    "Should autonomous vehicles prioritize passengers over pedestrians?",
+    "How do people judge harm caused by machines compared to harm caused by humans?",
+    "What does utilitarianism say about sacrificing one person to save five?",
+    "Is it acceptable for an algorithm to make life and death decisions?",
+    "How does cultural background affect moral judgments?",
+    "What are deontological constraints?",
+    "Do people trust AI advisors in moral dilemmas?",
+]
+passages = [
+    "The trolley problem is a thought experiment in ethics about sacrificing one person to save a larger number.",
+    "Participants judged machines more harshly than humans for the same harmful outcome.",
+    "Self-driving cars face trade-offs between the safety of their passengers and that of pedestrians.",
+    "Deontological ethics holds that some actions are forbidden regardless of their consequences.",
+    "Across countries, preferences to spare the young over the elderly varied with cultural distance.",
+]
+
+def latencies_ms(embeddings, n_queries):
+    embeddings.embed_query(queries[0])  # warm-up
+    timings = []
+    for i in range(n_queries):
+        start = time.perf_counter()
+        embeddings.embed_query(queries[i % len(queries)])
+        timings.append((time.perf_counter() - start) * 1000)
+    return np.array(timings)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parity check and single-query latency of the embedding backends.")
+    parser.add_argument("--backends", nargs="+", default=list(backends), choices=backends)
+    parser.add_argument("--threads", type=int, default=None, help="torch CPU threads")
+    parser.add_argument("--queries", type=int, default=100, help="single-query encodes timed per backend")
+    parser.add_argument("--tolerance", type=float, default=0.99, help="minimum cosine similarity to the reference")
+    args = parser.parse_args()
+
+    reference = make_embeddings("torch", device="cpu", threads=args.threads)
+    for backend in args.backends:
+        try:
+            embeddings = reference if backend == "torch" else make_embeddings(backend, device="cpu", threads=args.threads)
+        except ImportError as e:
+            print(f"{backend:<6} unavailable: {e}")
+            continue
+        try:
+            parity = f"min cosine to reference {check_parity(embeddings, reference, queries, passages, args.tolerance):.5f}"
+        except ValueError as e:
+            parity = f"FAILED: {e}"
+        timings = latencies_ms(embeddings, args.queries)
+        print(f"{backend:<6} {parity}  single query: p50 {np.percentile(timings, 50):7.2f} ms  "
+              f"p99 {np.percentile(timings, 99):7.2f} ms")
@@ -0,0 +1,55 @@
+import argparse
+import statistics
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import openai
+from langchain_openai import ChatOpenAI
+
+from llm_clients import LLMClients
+from stub_server import StubHandler
+
+# Time per request of a fresh client for every request (as the discriminator of old_chains/legacy.py and
+# paper_processing.get_key_opinions_and_concepts without a client did) against the pooled clients of
+# llm_clients.py, for a LangChain chat model and for the OpenAI client. By default against stub_server.py,
+# started in this process with no latency, so the difference is the client and connection setup; with --url
+# against a real endpoint.
+# Run from the repository root: python kb/benchmark_llm_clients.py [--requests 50] [--url http://10.249.72.3:8000/v1]
+
+messages = [{"role": "user", "content": "How do you think the internet will change in the next 10 years?"}]
+
+def timed(call, requests):
+    seconds = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        call()
+        seconds.append(time.perf_counter() - start)
+    return statistics.median(seconds) * 1000
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fresh LLM clients per request vs the pooled clients of llm_clients.py.")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--url", help="OpenAI-compatible endpoint to measure instead of the stub server")
+    args = parser.parse_args()
+
+    if args.url:
+        url = args.url
+    else:
+        StubHandler.latency = 0.0
+        server = ThreadingHTTPServer(("localhost", 0), StubHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://localhost:{server.server_address[1]}/v1"
+
+    registry = LLMClients()
+    print(f"median of {args.requests} requests to {url}")
+    fresh = timed(lambda: ChatOpenAI(base_url=url, api_key='gibberish').invoke(messages), args.requests)
+    pooled = timed(lambda: registry.chat_model(url, api_key='gibberish').invoke(messages), args.requests)
+    print(f"{'chat model':<16}{fresh:>10.1f} ms fresh{pooled:>10.1f} ms pooled")
+    fresh = timed(lambda: openai.OpenAI(base_url=url, api_key='gibberish').chat.completions.create(model="stub", messages=messages),
+                  args.requests)
+    pooled = timed(lambda: registry.openai_client(url, api_key='gibberish').chat.completions.create(model="stub", messages=messages),
+                   args.requests)
+    print(f"{'OpenAI client':<16}{fresh:>10.1f} ms fresh{pooled:>10.1f} ms pooled")
+    for line in registry.stats():
+        print(line)
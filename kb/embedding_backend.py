@@ -0,0 +1,102 @@
+import os
+
+import numpy as np
+
+# Shared factory for the BGE embedder used by vector_store.py, main_chain/chat_history.py and
+# old_chains/prompt-engineering.py. The defaults can be overridden without editing those scripts:
+#   EMBEDDING_DEVICE=cpu|cuda|mps          (default: the first GPU if there is one, otherwise the CPU)
+#   EMBEDDING_BACKEND=torch|int8|onnx      (default: torch; int8 and onnx are CPU-only)
+#   EMBEDDING_THREADS=4                    (default: torch's choice, usually the number of cores)
+model_name = "BAAI/bge-base-en-v1.5"
+encode_kwargs = {"normalize_embeddings": False}
+backends = ("torch", "int8", "onnx")
+
+def default_device():
+    """
+    Use the first GPU when there is one (CUDA, then Apple MPS), otherwise fall back to the CPU.
+    """
+    import torch
+    if torch.cuda.is_available():
+        return "cuda"
+    if getattr(torch.backends, "mps", None) is not None and torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+def set_threads(threads):
+    """
+    Limit the intra-op threads torch uses for CPU encodes. A single query only keeps a few cores busy;
+    leaving the rest free helps when the process also serves other work.
+    """
+    import torch
+    torch.set_num_threads(threads)
+
+def make_embeddings(backend=None, device=None, threads=None, model_name=model_name, encode_kwargs=encode_kwargs):
+    """
+    Create the LangChain embedder for model_name.
+
+    Args:
+        backend (str): 'torch' runs the model as published. On the CPU, 'int8' applies dynamic int8
+            quantization to its linear layers and 'onnx' runs it with ONNX Runtime (sentence-transformers >= 3.2
+            with the onnx extra). Both speed up the query-side encode; check them with check_parity.
+        device (str): 'cpu', 'cuda', 'cuda:1', 'mps', ...; defaults to default_device().
+        threads (int): Number of torch CPU threads, if given.
+        model_name (str): Hugging Face model name.
+        encode_kwargs (dict): Passed on to SentenceTransformer.encode.
+
+    Returns:
+        HuggingFaceBgeEmbeddings
+    """
+    from langchain_community.embeddings import HuggingFaceBgeEmbeddings
+
+    backend = backend or os.environ.get("EMBEDDING_BACKEND", "torch")
+    device = device or os.environ.get("EMBEDDING_DEVICE") or default_device()
+    threads = threads or (int(os.environ["EMBEDDING_THREADS"]) if os.environ.get("EMBEDDING_THREADS") else None)
+    if backend not in backends:
+        raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {backends}")
+    if backend != "torch" and device != "cpu":
+        raise ValueError(f"The {backend} embedding backend runs on the CPU only, not on {device}")
+    if threads:
+        set_threads(threads)
+
+    model_kwargs = {"device": device}
+    if backend == "onnx":
+        model_kwargs["backend"] = "onnx"
+    hf = HuggingFaceBgeEmbeddings(
+        model_name=model_name,
+        model_kwargs=model_kwargs,
+        encode_kwargs=encode_kwargs
+    )
+    if backend == "int8":
+        import torch
+        hf.client = torch.quantization.quantize_dynamic(hf.client, {torch.nn.Linear}, dtype=torch.qint8)
+    print(f"Embedding backend: {model_name} ({backend} on {device})")
+    return hf
+
+def check_parity(candidate, reference, queries, passages, tolerance=0.99):
+    """
+    Compare the vectors of a candidate embedder with those of the reference model on the same texts.
+
+    Args:
+        candidate, reference: LangChain embedders.
+        queries (list): Texts embedded with embed_query.
+        passages (list): Texts embedded with embed_documents.
+        tolerance (float): Minimum cosine similarity between the candidate and reference vector of every text.
+
+    Returns:
+        float: The lowest cosine similarity found.
+
+    Raises:
+        ValueError: If a vector is further from its reference than the tolerance allows.
+    """
+    def unit(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    similarities = np.concatenate([
+        np.sum(unit([candidate.embed_query(q) for q in queries]) * unit([reference.embed_query(q) for q in queries]), axis=1),
+        np.sum(unit(candidate.embed_documents(passages)) * unit(reference.embed_documents(passages)), axis=1),
+    ])
+    lowest = float(similarities.min())
+    if lowest < tolerance:
+        raise ValueError(f"Embedding parity check failed: cosine similarity {lowest:.4f} < {tolerance}")
+    return lowest
@@ -0,0 +1,134 @@
+import hashlib
+import sqlite3
+import time
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+class EmbeddingCache:
+    """
+    Disk-backed store of chunk embeddings keyed by (model name, normalize flag, hash of the chunk text).
+    Entries are evicted least-recently-used first once the cache holds more than max_entries vectors.
+    """
+
+    def __init__(self, path="kb/embedding_cache.sqlite", max_entries=200_000):
+        """
+        Args:
+            path (str): SQLite file holding the cache; created if it does not exist.
+            max_entries (int): Maximum number of cached vectors (a 768-d float32 vector takes about 3 KB).
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, normalize INTEGER NOT NULL, text_hash TEXT NOT NULL,"
+            " vector BLOB NOT NULL, last_used INTEGER NOT NULL,"
+            " PRIMARY KEY (model, normalize, text_hash))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.conn.commit()
+
+    @staticmethod
+    def text_hash(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model, normalize, hashes, chunk_size=500):
+        """
+        Look up cached vectors and mark them as recently used.
+
+        Returns:
+            dict: text hash -> float32 vector, for the hashes that were cached.
+        """
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        for start in range(0, len(unique), chunk_size):
+            chunk = unique[start:start + chunk_size]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND normalize = ? AND text_hash IN ({placeholders})",
+                [model, int(normalize), *chunk],
+            ).fetchall()
+            for text_hash, vector in rows:
+                found[text_hash] = np.frombuffer(vector, dtype=np.float32)
+        if found:
+            now = time.time_ns()
+            self.conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND normalize = ? AND text_hash = ?",
+                [(now, model, int(normalize), text_hash) for text_hash in found],
+            )
+            self.conn.commit()
+        return found
+
+    def put_many(self, model, normalize, items):
+        """
+        Store (text hash, vector) pairs, then evict the least recently used entries beyond max_entries.
+        """
+        now = time.time_ns()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, normalize, text_hash, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+            [(model, int(normalize), text_hash, np.asarray(vector, dtype=np.float32).tobytes(), now)
+             for text_hash, vector in items],
+        )
+        self.conn.commit()
+        self.evict()
+
+    def evict(self):
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self.conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            self.conn.commit()
+            self.evictions += excess
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        return (f"Embedding cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1%} hit rate), "
+                f"{self.evictions} evicted, {count} entries in {self.path}")
+
+    def close(self):
+        self.conn.close()
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps a LangChain embedding model so that embed_documents only computes vectors for chunks not in the cache.
+    Queries are passed straight through.
+    """
+
+    def __init__(self, embeddings, cache, model_name, normalize):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name
+        self.normalize = normalize
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [self.cache.text_hash(text) for text in texts]
+        cached = self.cache.get_many(self.model_name, self.normalize, hashes)
+
+        # embed each missing text once, even if it occurs several times in this batch
+        missing = {}
+        for text_hash, text in zip(hashes, texts):
+            if text_hash not in cached and text_hash not in missing:
+                missing[text_hash] = text
+        n_missing = sum(text_hash not in cached for text_hash in hashes)
+        self.cache.hits += len(texts) - n_missing
+        self.cache.misses += n_missing
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(self.model_name, self.normalize, computed.items())
+            cached.update((text_hash, np.asarray(vector, dtype=np.float32)) for text_hash, vector in computed.items())
+        return [cached[text_hash].tolist() for text_hash in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
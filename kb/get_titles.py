@@ -1,7 +1,24 @@
+import json
 import os
+import random
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 import time
+from concurrent.futures import ThreadPoolExecutor
+from rate_limit import TokenBucket
+
+ssrn_url = "https://papers.ssrn.com/sol3/papers.cfm?abstract_id={ssrn_id}"
+title_cache_path = "kb/ssrn_titles.json"
+
+def parse_title(content):
+    """
+    Extract the citation_title meta tag from an SSRN abstract page, or None if it has none.
+    """
+    soup = BeautifulSoup(content, 'html.parser')
+    meta_tag = soup.find('meta', attrs={'name': 'citation_title'})
+    return meta_tag.get('content') if meta_tag else None
 
 def get_paper_title(ssrn_id):
     """
@@ -17,10 +34,7 @@ def get_paper_title(ssrn_id):
     try:
         response = requests.get(url)
         if response.status_code == 200:
-            soup = BeautifulSoup(response.content, 'html.parser')
-            meta_tag = soup.find('meta', attrs={'name': 'citation_title'})
-            if meta_tag:
-                return meta_tag.get('content')
+            return parse_title(response.content)
         else:
             print(f"Failed to fetch URL for SSRN ID {ssrn_id}, status code: {response.status_code}")
     except Exception as e:
@@ -47,10 +61,7 @@ def get_paper_title_with_rate_limit(ssrn_id, max_retries=5, initial_wait=10):
         try:
             response = requests.get(url)
             if response.status_code == 200:
-                soup = BeautifulSoup(response.content, 'html.parser')
-                meta_tag = soup.find('meta', attrs={'name': 'citation_title'})
-                if meta_tag:
-                    return meta_tag.get('content')
+                return parse_title(response.content)
             elif response.status_code == 429:
                 print(f"Rate limit encountered. Retrying in {wait_time} seconds...")
                 time.sleep(wait_time)
@@ -66,26 +77,134 @@ def get_paper_title_with_rate_limit(ssrn_id, max_retries=5, initial_wait=10):
     print(f"FAIL: Exceeded maximum retries for SSRN ID {ssrn_id}.")
     return None
 
-def rename_files(folder_path):
+class TitleCache:
+    """
+    Persistent SSRN ID -> title mapping stored as a JSON file, so titles are fetched once across rebuilds.
+    Only titles that were found are stored; failed lookups are retried next time.
+    """
+
+    def __init__(self, path=title_cache_path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, encoding='utf-8') as f:
+                self.titles = json.load(f)
+        except FileNotFoundError:
+            self.titles = {}
+
+    def get(self, ssrn_id):
+        with self.lock:
+            return self.titles.get(str(ssrn_id))
+
+    def put(self, ssrn_id, title):
+        if title:
+            with self.lock:
+                self.titles[str(ssrn_id)] = title
+
+    def save(self):
+        with self.lock:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.titles, f, indent=1, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+def fetch_title(session, ssrn_id, limiter, max_retries=5, initial_wait=10, base_url=ssrn_url):
+    """
+    Fetch one title through a shared session and rate limiter, backing off on 429 responses.
+
+    Args:
+        session (requests.Session): Pooled session shared by all workers.
+        ssrn_id (str): The SSRN abstract ID.
+        limiter (TokenBucket): Shared request rate limiter.
+        max_retries (int): Maximum number of retries for rate-limited requests.
+        initial_wait (int): Initial wait time in seconds between retries, doubled on every retry.
+        base_url (str): URL template with an {ssrn_id} field, e.g. pointing at a local stub server.
+
+    Returns:
+        str: The paper's title, or None if not found after retries.
+    """
+    url = base_url.format(ssrn_id=ssrn_id)
+    wait_time = initial_wait
+    for _ in range(max_retries + 1):
+        limiter.acquire()
+        try:
+            response = session.get(url, timeout=30)
+        except Exception as e:
+            print(f"Error fetching title for SSRN ID {ssrn_id}: {e}")
+            return None
+        if response.status_code == 200:
+            return parse_title(response.content)
+        if response.status_code != 429:
+            print(f"Failed to fetch URL for SSRN ID {ssrn_id}, status code: {response.status_code}")
+            return None
+        try:
+            wait = float(response.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            wait = wait_time * (0.5 + random.random())
+        print(f"Rate limit encountered for SSRN ID {ssrn_id}. Retrying in {wait:.1f} seconds...")
+        time.sleep(wait)
+        wait_time *= 2  # Exponential backoff
+    print(f"FAIL: Exceeded maximum retries for SSRN ID {ssrn_id}.")
+    return None
+
+def resolve_titles(ssrn_ids, cache=None, max_workers=4, requests_per_second=1.0, base_url=ssrn_url, **retry_kwargs):
+    """
+    Resolve many SSRN IDs to titles: cached IDs are answered locally, the rest are fetched concurrently
+    through one pooled session, with all workers sharing a single token-bucket rate limit.
+
+    Args:
+        ssrn_ids (list): SSRN abstract IDs.
+        cache (TitleCache): Title cache to read and update; a new one at title_cache_path if None.
+        max_workers (int): Maximum number of concurrent requests.
+        requests_per_second (float): Request rate shared by all workers.
+        base_url (str): URL template with an {ssrn_id} field.
+        retry_kwargs: max_retries and initial_wait, passed on to fetch_title.
+
+    Returns:
+        dict: SSRN ID -> title (None for IDs that could not be resolved).
+    """
+    cache = cache if cache is not None else TitleCache()
+    ssrn_ids = list(dict.fromkeys(str(ssrn_id) for ssrn_id in ssrn_ids))
+    titles = {ssrn_id: cache.get(ssrn_id) for ssrn_id in ssrn_ids}
+    missing = [ssrn_id for ssrn_id, title in titles.items() if title is None]
+    if missing:
+        limiter = TokenBucket(requests_per_second)
+        with requests.Session() as session:
+            session.mount("https://", HTTPAdapter(pool_maxsize=max_workers))
+            session.mount("http://", HTTPAdapter(pool_maxsize=max_workers))
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                fetched = pool.map(lambda ssrn_id: fetch_title(session, ssrn_id, limiter, base_url=base_url, **retry_kwargs), missing)
+                for ssrn_id, title in zip(missing, fetched):
+                    titles[ssrn_id] = title
+                    cache.put(ssrn_id, title)
+        cache.save()
+    print(f"Resolved {len(ssrn_ids)} SSRN titles: {len(ssrn_ids) - len(missing)} cached, "
+          f"{sum(titles[ssrn_id] is not None for ssrn_id in missing)} fetched, "
+          f"{sum(title is None for title in titles.values())} unresolved")
+    return titles
+
+def rename_files(folder_path, cache=None):
     """
     Rename SSRN PDF files based on their titles.
 
     Args:
         folder_path (str): Path to the folder containing SSRN PDF files.
+        cache (TitleCache): Title cache passed on to resolve_titles.
     """
-    for filename in os.listdir(folder_path):
-        if filename.startswith("ssrn-") and filename.endswith(".pdf"):
-            ssrn_id = filename.split("-")[1].split(".")[0]
-            title = get_paper_title(ssrn_id)
-            if title:
-                sanitized_title = "".join(c if c.isalnum() or c in " -_()" else "_" for c in title)
-                new_filename = f"{sanitized_title}.pdf"
-                old_path = os.path.join(folder_path, filename)
-                new_path = os.path.join(folder_path, new_filename)
-                os.rename(old_path, new_path)
-                print(f"Renamed '{filename}' to '{new_filename}'")
-            else:
-                print(f"Could not fetch title for SSRN ID {ssrn_id}")
+    files = {filename: filename.split("-")[1].split(".")[0] for filename in os.listdir(folder_path)
+             if filename.startswith("ssrn-") and filename.endswith(".pdf")}
+    titles = resolve_titles(files.values(), cache)
+    for filename, ssrn_id in files.items():
+        title = titles[ssrn_id]
+        if title:
+            sanitized_title = "".join(c if c.isalnum() or c in " -_()" else "_" for c in title)
+            new_filename = f"{sanitized_title}.pdf"
+            old_path = os.path.join(folder_path, filename)
+            new_path = os.path.join(folder_path, new_filename)
+            os.rename(old_path, new_path)
+            print(f"Renamed '{filename}' to '{new_filename}'")
+        else:
+            print(f"Could not fetch title for SSRN ID {ssrn_id}")
 
 # Example usage
 if __name__ == "__main__":
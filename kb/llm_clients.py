@@ -0,0 +1,247 @@
+import os
+import threading
+import time
+from collections import deque
+
+import httpx
+
+# Shared clients for the OpenAI-compatible LLM endpoints used by main_chain/, old_chains/ and paper_processing.py.
+# Every endpoint gets one keep-alive connection pool (sync and async), reused by all chat models and OpenAI
+# clients created for it, so a request does not pay for a new TCP connection or client. The defaults can be
+# overridden without editing the scripts:
+#   LLM_TIMEOUT=120          (seconds to wait for a response or the next streamed chunk)
+#   LLM_CONNECT_TIMEOUT=5    (seconds to establish a connection)
+#   LLM_MAX_RETRIES=2        (retries of the OpenAI client on connection errors, 408, 409, 429 and 5xx)
+#   LLM_MAX_CONNECTIONS=32   (connections per endpoint)
+timeout = float(os.environ.get("LLM_TIMEOUT", 120))
+connect_timeout = float(os.environ.get("LLM_CONNECT_TIMEOUT", 5))
+max_retries = int(os.environ.get("LLM_MAX_RETRIES", 2))
+max_connections = int(os.environ.get("LLM_MAX_CONNECTIONS", 32))
+keepalive_expiry = 60 # seconds an idle connection is kept open
+
+def endpoint_url(base_url=None):
+    # the OpenAI client's default: OPENAI_BASE_URL if set (e.g. kb/stub_server.py), otherwise the OpenAI API
+    return (base_url or os.environ.get("OPENAI_BASE_URL") or "https://api.openai.com/v1").rstrip("/")
+
+class EndpointMetrics:
+    """
+    Latency of the requests to one endpoint: the time to the first byte of the response body (for streamed
+    completions, about the time to the first token) and the time to its end, over the last `window` requests.
+    """
+
+    def __init__(self, url, window=1000):
+        self.url = url
+        self.requests = 0
+        self.errors = 0
+        self.first_byte = deque(maxlen=window)
+        self.total = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, first_byte, total, error):
+        with self.lock:
+            self.requests += 1
+            self.errors += error
+            if first_byte is not None:
+                self.first_byte.append(first_byte)
+            self.total.append(total)
+
+    def percentile(self, values, q):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+    def summary(self):
+        with self.lock:
+            first_byte, total = list(self.first_byte), list(self.total)
+            requests, errors = self.requests, self.errors
+        return {"requests": requests, "errors": errors,
+                "first_byte_p50": self.percentile(first_byte, 0.5), "first_byte_p99": self.percentile(first_byte, 0.99),
+                "total_p50": self.percentile(total, 0.5), "total_p99": self.percentile(total, 0.99)}
+
+    def stats(self):
+        summary = self.summary()
+        return (f"LLM endpoint {self.url}: {summary['requests']} requests, {summary['errors']} errors, "
+                f"first byte p50 {summary['first_byte_p50']:.2f} s / p99 {summary['first_byte_p99']:.2f} s, "
+                f"total p50 {summary['total_p50']:.2f} s / p99 {summary['total_p99']:.2f} s")
+
+class MeteredStream(httpx.SyncByteStream):
+    def __init__(self, stream, start, error, metrics):
+        self.stream = stream
+        self.start = start
+        self.error = error
+        self.metrics = metrics
+        self.first_byte = None
+
+    def __iter__(self):
+        for chunk in self.stream:
+            if self.first_byte is None:
+                self.first_byte = time.perf_counter() - self.start
+            yield chunk
+
+    def close(self):
+        self.stream.close()
+        self.metrics.record(self.first_byte, time.perf_counter() - self.start, self.error)
+
+class MeteredAsyncStream(httpx.AsyncByteStream):
+    def __init__(self, stream, start, error, metrics):
+        self.stream = stream
+        self.start = start
+        self.error = error
+        self.metrics = metrics
+        self.first_byte = None
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            if self.first_byte is None:
+                self.first_byte = time.perf_counter() - self.start
+            yield chunk
+
+    async def aclose(self):
+        await self.stream.aclose()
+        self.metrics.record(self.first_byte, time.perf_counter() - self.start, self.error)
+
+class MeteredTransport(httpx.BaseTransport):
+    """
+    The pooled transport of an endpoint, recording the latency of every request in its metrics.
+    """
+
+    def __init__(self, transport, metrics):
+        self.transport = transport
+        self.metrics = metrics
+
+    def handle_request(self, request):
+        start = time.perf_counter()
+        try:
+            response = self.transport.handle_request(request)
+        except Exception:
+            self.metrics.record(None, time.perf_counter() - start, True)
+            raise
+        response.stream = MeteredStream(response.stream, start, response.status_code >= 400, self.metrics)
+        return response
+
+    def close(self):
+        self.transport.close()
+
+class MeteredAsyncTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport, metrics):
+        self.transport = transport
+        self.metrics = metrics
+
+    async def handle_async_request(self, request):
+        start = time.perf_counter()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except Exception:
+            self.metrics.record(None, time.perf_counter() - start, True)
+            raise
+        response.stream = MeteredAsyncStream(response.stream, start, response.status_code >= 400, self.metrics)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+class LLMClients:
+    """
+    Registry of the LLM clients of a process: one pooled HTTP client (sync and async) per endpoint, and the
+    LangChain chat models and OpenAI clients built on them, each created once per configuration. Create the
+    clients after forking (chat_server.py does so in each worker), since connections cannot be shared.
+    """
+
+    def __init__(self, timeout=timeout, connect_timeout=connect_timeout, max_retries=max_retries,
+                 max_connections=max_connections):
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                                   keepalive_expiry=keepalive_expiry)
+        self.metrics = {}
+        self.http_clients = {}
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    def http_client(self, base_url=None, asynchronous=False):
+        """
+        Returns:
+            httpx.Client or httpx.AsyncClient: The connection pool of the endpoint.
+        """
+        url = endpoint_url(base_url)
+        with self.lock:
+            client = self.http_clients.get((url, asynchronous))
+            if client is None:
+                metrics = self.metrics.setdefault(url, EndpointMetrics(url))
+                if asynchronous:
+                    transport = MeteredAsyncTransport(httpx.AsyncHTTPTransport(limits=self.limits), metrics)
+                    client = httpx.AsyncClient(transport=transport, timeout=self.timeout)
+                else:
+                    transport = MeteredTransport(httpx.HTTPTransport(limits=self.limits), metrics)
+                    client = httpx.Client(transport=transport, timeout=self.timeout)
+                self.http_clients[(url, asynchronous)] = client
+        return client
+
+    def cached(self, key, create):
+        with self.lock:
+            client = self.clients.get(key)
+        if client is None:
+            client = create()
+            with self.lock:
+                client = self.clients.setdefault(key, client)
+        return client
+
+    def chat_model(self, base_url=None, api_key=None, max_retries=None, **kwargs):
+        """
+        LangChain chat model for an endpoint; calls with the same arguments return the same model.
+
+        Args:
+            base_url (str): OpenAI-compatible endpoint; defaults to OPENAI_BASE_URL or the OpenAI API.
+            api_key (str): Defaults to OPENAI_API_KEY.
+            max_retries (int): Defaults to the registry's.
+            **kwargs: Passed on to ChatOpenAI (model_name, temperature, metadata, ...).
+
+        Returns:
+            ChatOpenAI
+        """
+        from langchain_openai import ChatOpenAI
+
+        url = endpoint_url(base_url)
+        max_retries = self.max_retries if max_retries is None else max_retries
+        key = ("chat", url, api_key, max_retries, repr(sorted(kwargs.items())))
+        return self.cached(key, lambda: ChatOpenAI(
+            base_url=url, api_key=api_key, max_retries=max_retries, request_timeout=self.timeout,
+            http_client=self.http_client(url), http_async_client=self.http_client(url, asynchronous=True), **kwargs))
+
+    def openai_client(self, base_url=None, api_key=None, max_retries=None):
+        """
+        Returns:
+            openai.OpenAI: Client for an endpoint (see chat_model for the arguments), shared by all callers.
+        """
+        import openai
+
+        url = endpoint_url(base_url)
+        max_retries = self.max_retries if max_retries is None else max_retries
+        return self.cached(("openai", url, api_key, max_retries), lambda: openai.OpenAI(
+            base_url=url, api_key=api_key, max_retries=max_retries, timeout=self.timeout, http_client=self.http_client(url)))
+
+    def used(self):
+        with self.lock:
+            return [endpoint for endpoint in self.metrics.values() if endpoint.requests]
+
+    def summary(self):
+        """
+        Returns:
+            dict: The latency percentiles (seconds) and request counts of every endpoint that was used, by URL.
+        """
+        return {endpoint.url: endpoint.summary() for endpoint in self.used()}
+
+    def stats(self):
+        """
+        Returns:
+            list: One latency summary line per endpoint that was used.
+        """
+        return [endpoint.stats() for endpoint in self.used()]
+
+# the registry of this process
+registry = LLMClients()
+
+def chat_model(base_url=None, api_key=None, **kwargs):
+    return registry.chat_model(base_url, api_key, **kwargs)
+
+def openai_client(base_url=None, api_key=None, max_retries=None):
+    return registry.openai_client(base_url, api_key, max_retries)
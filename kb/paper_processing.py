@@ -1,26 +1,35 @@
 import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import openai
-import PyPDF2
+from llm_clients import openai_client, registry
+from pdf_extraction import extract_many, extract_pages
+from rate_limit import RateLimiter
 
 # Define the path to the folder containing PDF papers
 pdf_folder_path = 'kb/pdfs' # path to your PDFs
 output_folder_path = 'kb/paper_processing_output' # path to created folder of summary txts
 
+# Summarization settings. The endpoint is taken from OPENAI_BASE_URL if set, so a local stub server
+# (see stub_server.py) can stand in for the OpenAI API.
+model = "gpt-4o-mini"
+max_workers = 4 # number of papers summarized concurrently
+requests_per_minute = 500 # keep these below the limits of your API tier
+tokens_per_minute = 200_000
+max_retries = 5 # retries per paper on 429, 5xx and connection errors
+initial_wait = 2 # seconds before the first retry, doubled on every further retry
+
 # Ensure output folder exists
 if not os.path.exists(output_folder_path):
     os.makedirs(output_folder_path)
 
-# Function to extract text from a PDF file
+# Function to extract text from a PDF file (cached, see pdf_extraction.py)
 def extract_text_from_pdf(pdf_path):
-    with open(pdf_path, 'rb') as file:
-        reader = PyPDF2.PdfReader(file)
-        text = ''
-        for page in range(len(reader.pages)):
-            text += reader.pages[page].extract_text()
-    return text
+    return ''.join(extract_pages(pdf_path))
 
 # Function to query GPT for key opinions and concepts
-def get_key_opinions_and_concepts(text):
+def get_key_opinions_and_concepts(text, client=None, limiter=None, max_retries=0):
     one_shot = """
 
 Language models (LMs) have become fundamental to advancements in natural language processing (NLP), enabling significant improvements in tasks such as text generation, machine translation, sentiment analysis, and question answering. Recent developments have shifted from task-specific models to more generalized models that can be pretrained on massive corpora and then fine-tuned for specific applications. This shift has been driven by models based on the transformer architecture, such as GPT (Generative Pretrained Transformer), BERT (Bidirectional Encoder Representations from Transformers), and T5 (Text-To-Text Transfer Transformer). These models are transforming how NLP is applied across various domains, including conversational AI, information retrieval, and more complex reasoning tasks.
@@ -46,56 +55,116 @@ In conclusion, large-scale pretrained language models represent a major advancem
         "Create a roughly one or two page shortened rewrite that can be used to populate a RAG knowledge base for answering questions. Write the key opinions and concepts in the same style as the professor would, without necessarily quoting directly:"
     )
     
+    messages = [
+        {"role": "system", "content": "You are an assistant that provides shortened rewritten versions of scientific papers without headings or text formatting. You only provide body-text with newlines between paragraphs."},
+        {
+            "role": "user",
+            "content": "Please rewrite the attached paper on language models to be shorter but still contain the key opinions and concepts."
+        },
+        {
+            "role": "assistant",
+            "content": one_shot
+        },
+        {
+            "role": "user",
+            "content": prompt
+        }
+    ]
+
+    client = client or openai_client(max_retries=0) # one pooled client for all papers (see llm_clients.py)
+    attempt = 0
+    while True:
+        try:
+            if limiter:
+                # rough token estimate (~4 characters per token) plus room for the one or two page answer
+                limiter.acquire(tokens=sum(len(message["content"]) for message in messages) // 4 + 1500)
+            response = client.chat.completions.create(model=model, messages=messages)
+            return response.choices[0].message.content.strip()
+        except Exception as e:
+            if attempt < max_retries and is_retryable(e):
+                wait = retry_wait(e, attempt)
+                print(f"Summary request failed ({e.__class__.__name__}), retrying in {wait:.1f} seconds...")
+                time.sleep(wait)
+                attempt += 1
+                continue
+            print(f"Error generating summary for the paper: {e}")
+            return None
+
+# Rate limits, server errors and dropped connections are worth retrying; bad requests are not
+def is_retryable(error):
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+# Exponential backoff with jitter, unless the server says how long to wait
+def retry_wait(error, attempt):
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
     try:
-        client = openai.OpenAI()
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are an assistant that provides shortened rewritten versions of scientific papers without headings or text formatting. You only provide body-text with newlines between paragraphs."},
-                {
-                    "role": "user",
-                    "content": "Please rewrite the attached paper on language models to be shorter but still contain the key opinions and concepts."
-                },
-                {
-                    "role": "assistant",
-                    "content": one_shot
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ]
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        print(f"Error generating summary for the paper: {e}")
-        return None
-
-# Function to process all PDFs in the folder
-def process_papers(pdf_folder_path, output_folder_path):
-    for filename in os.listdir(pdf_folder_path):
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return initial_wait * 2 ** attempt * (0.5 + random.random())
+
+def summary_path(output_folder_path, filename):
+    return os.path.join(output_folder_path, f"{os.path.splitext(filename)[0]}_summary.txt")
+
+# Summarize and save a single paper, given the text extracted from it
+def process_paper(pdf_path, text, output_file_path, client, limiter):
+    filename = os.path.basename(pdf_path)
+    print(f"Processing file: {filename}")
+
+    if not text:
+        print(f"Failed to extract text from {filename}")
+        return
+
+    # Get key opinions and concepts using GPT
+    summary = get_key_opinions_and_concepts(text, client, limiter, max_retries)
+
+    if summary:
+        # Save the resulting summary to a distinct text file; written under a temporary name first
+        # so that an interrupted run never leaves a partial summary that would be skipped next time
+        tmp_path = f"{output_file_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as output_file:
+            output_file.write(summary)
+        os.replace(tmp_path, output_file_path)
+        print(f"Summary saved for {filename}")
+    else:
+        print(f"No summary generated for {filename}")
+
+# Function to process all PDFs in the folder, max_workers at a time.
+# PDFs that already have a summary are skipped, so an interrupted run can simply be restarted.
+def process_papers(pdf_folder_path, output_folder_path, max_workers=max_workers):
+    client = openai_client(max_retries=0) # retries are handled above, together with the rate limiter
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+
+    pending = []
+    for filename in sorted(os.listdir(pdf_folder_path)):
         if filename.endswith(".pdf"):
-            pdf_path = os.path.join(pdf_folder_path, filename)
-            print(f"Processing file: {filename}")
-            
-            # Extract text from the PDF - feeding to GPT as text
-            text = extract_text_from_pdf(pdf_path)
-            
-            if not text:
-                print(f"Failed to extract text from {filename}")
+            output_file_path = summary_path(output_folder_path, filename)
+            if os.path.exists(output_file_path):
+                print(f"Skipping {filename}, summary already exists")
                 continue
-            
-            # Get key opinions and concepts using GPT
-            summary = get_key_opinions_and_concepts(text)
-            
-            if summary:
-                # Save the resulting summary to a distinct text file
-                output_file_path = os.path.join(output_folder_path, f"{os.path.splitext(filename)[0]}_summary.txt")
-                with open(output_file_path, 'w', encoding='utf-8') as output_file:
-                    output_file.write(summary)
-                print(f"Summary saved for {filename}")
-            else:
-                print(f"No summary generated for {filename}")
+            pending.append((os.path.join(pdf_folder_path, filename), output_file_path))
+
+    start = time.perf_counter()
+    output_paths = dict(pending)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        # Extract text from the PDFs in worker processes - feeding to GPT as text.
+        # Each paper is submitted for summarization as soon as its text is available.
+        futures = {}
+        for pdf_path, pages in extract_many(list(output_paths)):
+            if pages is None:
+                continue # unreadable PDF, reported by extract_many
+            future = pool.submit(process_paper, pdf_path, ''.join(pages), output_paths[pdf_path], client, limiter)
+            futures[future] = pdf_path
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error processing {os.path.basename(futures[future])}: {e}")
+    print(f"Processed {len(pending)} papers in {time.perf_counter() - start:.1f} seconds")
+    for line in registry.stats():
+        print(line)
 
 # Main function to run the process
 if __name__ == "__main__":
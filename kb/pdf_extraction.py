@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import PyPDF2
+
+# Shared PDF text extraction for paper_processing.py and vector_store.py. Extracted pages are cached
+# on disk under the SHA-256 of the PDF, so each PDF is parsed once per content version.
+cache_dir = 'kb/extraction_cache'
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def iter_pdf_pages(pdf_path):
+    """
+    Parse the PDF and yield the text of one page at a time.
+    """
+    with open(pdf_path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        for page in reader.pages:
+            yield page.extract_text() or ''
+
+def iter_pages(pdf_path, cache_dir=cache_dir):
+    """
+    Yield the text of each page, from the extraction cache if this version of the PDF was parsed before.
+    Otherwise the PDF is parsed page by page and the cache entry is written once all pages are read.
+
+    Args:
+        pdf_path (str): Path to the PDF.
+        cache_dir (str): Directory of the extraction cache, or None to always parse.
+    """
+    if cache_dir is None:
+        yield from iter_pdf_pages(pdf_path)
+        return
+
+    cache_path = os.path.join(cache_dir, f"{file_sha256(pdf_path)}.json")
+    try:
+        with open(cache_path, encoding='utf-8') as f:
+            yield from json.load(f)
+        return
+    except FileNotFoundError:
+        pass
+
+    pages = []
+    for text in iter_pdf_pages(pdf_path):
+        pages.append(text)
+        yield text
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(pages, f)
+    os.replace(tmp_path, cache_path)
+
+def extract_pages(pdf_path, cache_dir=cache_dir):
+    """
+    Returns:
+        list: The text of each page.
+    """
+    return list(iter_pages(pdf_path, cache_dir))
+
+def extract_many(pdf_paths, max_workers=None, cache_dir=cache_dir):
+    """
+    Extract several PDFs in a process pool and yield (path, pages) in input order.
+    At most 2 * max_workers PDFs are in flight, so memory stays bounded for large folders.
+    A PDF that cannot be parsed is reported and yielded with pages None, so one bad file does not end the run.
+
+    Args:
+        pdf_paths (list): Paths to the PDFs.
+        max_workers (int): Number of worker processes; defaults to the number of CPUs.
+        cache_dir (str): Directory of the extraction cache, or None to always parse.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        in_flight = deque()
+        for pdf_path in pdf_paths:
+            in_flight.append((pdf_path, pool.submit(extract_pages, pdf_path, cache_dir)))
+            if len(in_flight) >= 2 * max_workers:
+                yield extracted(*in_flight.popleft())
+        while in_flight:
+            yield extracted(*in_flight.popleft())
+
+def extracted(path, future):
+    try:
+        return path, future.result()
+    except Exception as e:
+        print(f"Failed to extract text from {os.path.basename(path)}: {e}")
+        return path, None
@@ -0,0 +1,61 @@
+import threading
+import time
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: refills at `rate` tokens per second up to `capacity`.
+    acquire() blocks until the requested amount is available, so several worker threads
+    sharing one bucket stay under the rate together.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        Args:
+            rate (float): Tokens added per second.
+            capacity (float): Maximum burst size; defaults to one second worth of tokens (at least 1).
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """
+        Take `amount` tokens, sleeping until they are available. Amounts larger than the
+        capacity are allowed and simply wait for a full bucket.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+class RateLimiter:
+    """
+    Request and token budgets per minute, as published for OpenAI-compatible endpoints.
+    A limit of None disables that budget.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests = TokenBucket(requests_per_minute / 60) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute / 60, capacity=tokens_per_minute) if tokens_per_minute else None
+
+    def acquire(self, tokens=0):
+        waited = 0.0
+        if self.requests:
+            waited += self.requests.acquire()
+        if self.tokens and tokens:
+            waited += self.tokens.acquire(tokens)
+        return waited
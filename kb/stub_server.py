@@ -0,0 +1,220 @@
+import argparse
+import hashlib
+import html
+import json
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Local stand-in for an OpenAI-compatible chat completions endpoint, for exercising the pipelines
+# in this folder without network access or API costs. For example:
+#   python kb/stub_server.py --port 8001 --latency 2 --rate-limit-rate 0.2
+#   OPENAI_BASE_URL=http://localhost:8001/v1 OPENAI_API_KEY=stub python kb/paper_processing.py
+# It also serves SSRN-like abstract pages for get_titles.resolve_titles, e.g. with
+#   base_url="http://localhost:8001/sol3/papers.cfm?abstract_id={ssrn_id}"
+# With --prefill-rate and --prefix-cache-blocks it simulates the prefill time and prefix caching of a local
+# llama.cpp or vLLM server, and it streams completions ("stream": true), for measuring the time to first token:
+#   python kb/stub_server.py --port 8001 --latency 0.05 --prefill-rate 2000 --prefix-cache-blocks 4096
+
+def render(messages):
+    """
+    The prompt text of a chat completion request, with role markers as a chat template adds them.
+    """
+    return "".join(f"<|{message.get('role')}|>\n{message.get('content') or ''}<|end|>\n" for message in messages)
+
+class PrefixCache:
+    """
+    Simulated KV-cache prefix reuse, as in vLLM with --enable-prefix-caching: the prompt is cached in blocks of
+    block_size tokens, each identified by a hash of the whole prompt up to its end, so a block is only reused
+    when everything before it is identical. A new prompt is prefilled from its first block that is not cached.
+    The least recently used blocks are evicted beyond max_blocks. Tokens are counted as four characters.
+    """
+
+    def __init__(self, max_blocks, block_size=16):
+        self.max_blocks = max_blocks
+        self.block_chars = 4 * block_size
+        self.blocks = OrderedDict()
+        self.lock = threading.Lock()
+
+    def lookup(self, text):
+        """
+        Returns:
+            int: Number of leading tokens of text that were cached. All blocks of text are cached afterwards.
+        """
+        cached = 0
+        matching = True
+        digest = hashlib.sha1()
+        with self.lock:
+            for start in range(0, len(text) - self.block_chars + 1, self.block_chars):
+                digest.update(text[start:start + self.block_chars].encode("utf-8"))
+                key = digest.digest()
+                if matching and key in self.blocks:
+                    cached = start + self.block_chars
+                    self.blocks.move_to_end(key)
+                else:
+                    matching = False
+                    self.blocks[key] = True
+            while len(self.blocks) > self.max_blocks:
+                self.blocks.popitem(last=False)
+        return cached // 4
+
+class StubHandler(BaseHTTPRequestHandler):
+    # set from the command line in main()
+    latency = 0.0
+    rate_limit_rate = 0.0
+    error_rate = 0.0
+    prefill_rate = 0.0 # prompt tokens per second, 0 for no prefill time
+    token_latency = 0.0 # seconds per streamed token
+    prefix_cache = None
+    stats = {"requests": 0, "rate_limited": 0, "errors": 0, "prompt_tokens": 0, "cached_tokens": 0}
+    stats_lock = threading.Lock()
+
+    def count(self, key, n=1):
+        with self.stats_lock:
+            self.stats[key] += n
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def injected_failure(self):
+        """
+        Answer with a 429 or 500 at the configured rates. Returns True if the request was answered.
+        """
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            self.count("rate_limited")
+            self.send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}},
+                           headers={"Retry-After": "1"})
+            return True
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.count("errors")
+            self.send_json(500, {"error": {"message": "Internal server error"}})
+            return True
+        return False
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        ssrn_id = parse_qs(url.query).get("abstract_id", [None])[0]
+        if not url.path.endswith("/papers.cfm") or ssrn_id is None:
+            self.send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+        self.count("requests")
+        if self.injected_failure():
+            return
+
+        time.sleep(self.latency)
+        payload = (f'<html><head><meta name="citation_title" content="Stub paper {html.escape(ssrn_id)}">'
+                   f'</head><body></body></html>').encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        self.count("requests")
+        if self.injected_failure():
+            return
+
+        prompt = render(request.get("messages", []))
+        prompt_tokens = len(prompt) // 4
+        cached_tokens = self.prefix_cache.lookup(prompt) if self.prefix_cache is not None else 0
+        self.count("prompt_tokens", prompt_tokens)
+        self.count("cached_tokens", cached_tokens)
+        prefill = (prompt_tokens - cached_tokens) / self.prefill_rate if self.prefill_rate else 0.0
+        time.sleep(self.latency + prefill)
+        content = f"Stub summary of a {len(prompt)} character prompt."
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4,
+                 "total_tokens": prompt_tokens + len(content) // 4,
+                 "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+        if request.get("stream"):
+            self.stream(request, content, usage)
+            return
+        self.send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        })
+
+    def stream(self, request, content, usage):
+        """
+        Send the completion as server-sent events, one word per chunk, like the OpenAI streaming API.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        chunk = {"id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion.chunk", "created": int(time.time()),
+                 "model": request.get("model", "stub")}
+        try:
+            for i, word in enumerate(content.split(" ")):
+                if i:
+                    time.sleep(self.token_latency)
+                delta = {"role": "assistant", "content": word} if i == 0 else {"content": " " + word}
+                self.send_event({**chunk, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+            self.send_event({**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            if (request.get("stream_options") or {}).get("include_usage"):
+                self.send_event({**chunk, "choices": [], "usage": usage})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass # the client stopped reading, e.g. after the first token
+
+    def send_event(self, body):
+        self.wfile.write(f"data: {json.dumps(body)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub OpenAI-compatible server for local testing.")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds per completion or abstract page")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--prefill-rate", type=float, default=0.0, help="prompt tokens prefilled per second (0: no prefill time)")
+    parser.add_argument("--prefix-cache-blocks", type=int, default=0, help="16-token blocks of simulated prefix cache (0: off)")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds per streamed token")
+    args = parser.parse_args()
+
+    StubHandler.latency = args.latency
+    StubHandler.rate_limit_rate = args.rate_limit_rate
+    StubHandler.error_rate = args.error_rate
+    StubHandler.prefill_rate = args.prefill_rate
+    StubHandler.token_latency = args.token_latency
+    if args.prefix_cache_blocks:
+        StubHandler.prefix_cache = PrefixCache(args.prefix_cache_blocks)
+    server = ThreadingHTTPServer(("localhost", args.port), StubHandler)
+    print(f"Stub server listening on http://localhost:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Stub server stats: {StubHandler.stats}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import functools
+import re
+
+# Cleaning of parsed PDF text for vector_store.py: removes author/affiliation/keyword/abstract lines,
+# everything from "References" on, URLs, emails, numeric citations and the word "Introduction".
+
+def clean_text_reference(text):
+    """
+    The original cleaning function: nine separate re.sub passes, applied one after the other.
+    Kept as the golden reference for clean_text (see benchmark_cleaning.py).
+    """
+    # Remove common sections such as references, authors, institutions, etc.
+
+    # Remove preamble (authors, institutions, footnotes)
+    text = re.sub(r'(\bAuthors\b.*?(\n|$))', '', text, flags=re.IGNORECASE | re.DOTALL)
+    text = re.sub(r'(\bAffiliations\b.*?(\n|$))', '', text, flags=re.IGNORECASE | re.DOTALL)
+
+    # Remove references section
+    text = re.sub(r'(\bReferences\b.*)', '', text, flags=re.IGNORECASE | re.DOTALL)
+
+    # Remove anything related to keywords
+    text = re.sub(r'(\bKeywords\b.*?(\n|$))', '', text, flags=re.IGNORECASE | re.DOTALL)
+
+    # Remove URLs or emails
+    text = re.sub(r'(https?://\S+|www\.\S+)', '', text)
+    text = re.sub(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b', '', text)
+
+    # Remove footnotes or small print typically denoted by numbers or special characters
+    text = re.sub(r'\[\d+\]', '', text)
+
+    # Remove additional unwanted patterns, like section headers (optional)
+    text = re.sub(r'\bAbstract\b.*?(\n|$)', '', text, flags=re.IGNORECASE | re.DOTALL)
+    text = re.sub(r'\bIntroduction\b', '', text, flags=re.IGNORECASE)
+    return text.strip()
+
+# The passes above run in order, so an earlier pass changes what a later one sees. The single pass
+# reproduces the interactions that occur in real papers:
+#   - a removed line takes its newline with it, so when a keyword line contains a keyword of an
+#     earlier pass (e.g. "Abstract ... Keywords: ..."), the later pass also removes the following line;
+#   - "References" anywhere truncates the text, even inside a keyword line, URL or email that a later
+#     pass would have removed.
+# Known differences, all involving text glued together by an earlier removal: a URL or email containing
+# "authors", "affiliations" or "keywords", and a word directly after a removed [n] citation.
+_references = r'\breferences\b.*'
+_authors = r'\bauthors\b[^\n]*(?:\n|$)'
+_affiliations = rf'\baffiliations\b(?:{_authors}|[^\n])*(?:\n|$)'
+_keywords = rf'\bkeywords\b(?:{_authors}|{_affiliations}|{_references}|[^\n])*(?:\n|$)'
+_not_references = r'(?!\breferences\b)'
+_url = rf'(?-i:https?://|www\.)(?:{_not_references}\S)+'
+_email = (rf'\b(?=[A-Za-z0-9._%+-]+@)(?:{_not_references}[A-Za-z0-9._%+-])+'
+          rf'@(?:{_not_references}[A-Za-z0-9.-])+\.[A-Za-z]{{2,}}\b')
+_citation = r'\[\d+\]'
+_abstract = rf'\babstract\b(?:{_authors}|{_affiliations}|{_references}|{_keywords}|[^\n])*(?:\n|$)'
+_introduction = r'\bintroduction\b'
+
+# (trigger, pattern) in the order of the original passes, which decides between matches at the same position.
+# An alternative can only match if its trigger occurs in the case-folded text.
+_alternatives = [
+    ('authors', _authors),
+    ('affiliations', _affiliations),
+    ('references', _references),
+    ('keywords', _keywords),
+    (('://', 'www.'), _url),
+    ('@', _email),
+    ('[', _citation),
+    ('abstract', _abstract),
+    ('introduction', _introduction),
+]
+
+@functools.lru_cache(maxsize=None)
+def cleaning_pattern(present):
+    """
+    Args:
+        present (tuple): One flag per entry of _alternatives.
+
+    Returns:
+        re.Pattern: The alternation of the flagged patterns, or None if no flag is set.
+    """
+    patterns = [pattern for (_, pattern), flag in zip(_alternatives, present) if flag]
+    return re.compile("|".join(patterns), flags=re.IGNORECASE | re.DOTALL) if patterns else None
+
+def _occurs(trigger, folded):
+    return trigger in folded if isinstance(trigger, str) else any(t in folded for t in trigger)
+
+def clean_text(text):
+    """
+    Try to remove extra text from parsed PDF in a single pass of one precompiled pattern. Patterns whose
+    trigger does not occur on the page are left out of the alternation, so most pages are scanned for a
+    few of them only. Gives the same result as clean_text_reference apart from the edge cases listed above.
+    """
+    folded = text.casefold()
+    pattern = cleaning_pattern(tuple(_occurs(trigger, folded) for trigger, _ in _alternatives))
+    return (pattern.sub('', text) if pattern else text).strip()
+
+def clean_pages(pages):
+    """
+    Clean a stream of page texts lazily, yielding (page number, cleaned text) for the pages
+    that are not empty after cleaning.
+    """
+    for page_number, text in enumerate(pages):
+        cleaned_text = clean_text(text)
+        if cleaned_text:
+            yield page_number, cleaned_text
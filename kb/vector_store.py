@@ -1,40 +1,23 @@
+import json
 import os
-from langchain_community.document_loaders import PyPDFLoader
+import shutil
+import time
 from langchain_community.document_loaders import TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
 
+import embedding_backend
 import get_titles
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from pdf_extraction import extract_many, file_sha256, iter_pages
+from text_cleaning import clean_pages
 
+import faiss
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
-import re
 
 from_pdf = False # knowledge base from PDFs (without summarization by GPT) was not very effective - papers are too long
-
-# Try to remove extra text from parsed PDF
-def clean_text(text):
-    # Remove common sections such as references, authors, institutions, etc.
-    
-    # Remove preamble (authors, institutions, footnotes)
-    text = re.sub(r'(\bAuthors\b.*?(\n|$))', '', text, flags=re.IGNORECASE | re.DOTALL)
-    text = re.sub(r'(\bAffiliations\b.*?(\n|$))', '', text, flags=re.IGNORECASE | re.DOTALL)
-    
-    # Remove references section
-    text = re.sub(r'(\bReferences\b.*)', '', text, flags=re.IGNORECASE | re.DOTALL)
-    
-    # Remove anything related to keywords
-    text = re.sub(r'(\bKeywords\b.*?(\n|$))', '', text, flags=re.IGNORECASE | re.DOTALL)
-    
-    # Remove URLs or emails
-    text = re.sub(r'(https?://\S+|www\.\S+)', '', text)
-    text = re.sub(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b', '', text)
-    
-    # Remove footnotes or small print typically denoted by numbers or special characters
-    text = re.sub(r'\[\d+\]', '', text)
-    
-    # Remove additional unwanted patterns, like section headers (optional)
-    text = re.sub(r'\bAbstract\b.*?(\n|$)', '', text, flags=re.IGNORECASE | re.DOTALL)
-    text = re.sub(r'\bIntroduction\b', '', text, flags=re.IGNORECASE)
-    return text.strip()
+incremental = True # update the existing index with new/changed/removed files instead of rebuilding it from scratch
 
 # Setup OpenAI API (or you can use any other LLM provider)
 openai_api_key = os.environ.get('OPENAI_API_KEY')
@@ -42,80 +25,287 @@ print(f"OpenAI API Key: {openai_api_key}")
 
 if from_pdf:
     folder = 'kb/pdfs'
+    output_file = "kb/faiss_index_pdf"
 else:
     folder = 'kb/paper_processing_output'
-
-# Load all documents
-documents = []
-# loader = PyPDFLoader(os.path.join(pdf_folder, 'ssrn-4266038.pdf'))
-# docs_lazy = loader.lazy_load()
-# for doc in docs_lazy:
-#     cleaned_text = clean_text(doc.page_content)
-#     if cleaned_text:
-#         doc.page_content = cleaned_text
-#         documents.append(doc)
-for file in os.listdir(folder):
-    print(file)
-    if (from_pdf and file.endswith('.pdf')):
-        loader = PyPDFLoader(os.path.join(folder, file))
-        docs_lazy = loader.lazy_load()
-        for doc in docs_lazy:
-            cleaned_text = clean_text(doc.page_content)
-            if cleaned_text:
-                doc.page_content = cleaned_text
-                documents.append(doc)
-    elif (not from_pdf and file.endswith('.txt')):
-        loader = TextLoader(os.path.join(folder, file), encoding='utf-8')
-        docs = loader.load()
-        for doc in docs:
-            ssrn_id = file.split("-")[1].split("_")[0]
-            doc.metadata['title'] = get_titles.get_paper_title_with_rate_limit(ssrn_id)
-            documents.append(doc)
+    output_file = "kb/faiss_index_hf2"
 
 # Split documents into chunks
 text_splitter = RecursiveCharacterTextSplitter( # you can alter these parameters as you see fit
     chunk_size=800,
     chunk_overlap=200,
 )
-docs = text_splitter.split_documents(documents)
+
+# SSRN titles of the paper summaries, persisted across builds (see get_titles.TitleCache)
+title_cache = get_titles.TitleCache()
+
+def ssrn_id_of(file):
+    return file.split("-")[1].split("_")[0]
+
+def source_files(folder):
+    extension = '.pdf' if from_pdf else '.txt'
+    return sorted(file for file in os.listdir(folder) if file.endswith(extension))
+
+# Yield the documents of a single source file, one page at a time for PDFs. PDFs are read through the shared
+# extraction stage (pdf_extraction.py), which caches the page texts; pages may be passed in when already extracted.
+def load_file(folder, file, pages=None):
+    if from_pdf:
+        path = os.path.join(folder, file)
+        for page_number, cleaned_text in clean_pages(pages if pages is not None else iter_pages(path)):
+            yield Document(page_content=cleaned_text, metadata={'source': path, 'page': page_number})
+    else:
+        loader = TextLoader(os.path.join(folder, file), encoding='utf-8')
+        for doc in loader.lazy_load():
+            doc.metadata['title'] = title_cache.get(ssrn_id_of(file))
+            yield doc
+
+# Yield (file, pages) for the given files; PDFs are extracted in a process pool, text files are read later.
+# A PDF that failed to extract (reported by extract_many) is skipped and appended to failed instead.
+# The SSRN titles of text files are resolved up front in one concurrent batch and land in title_cache.
+def extracted(folder, files, failed):
+    if from_pdf:
+        for path, pages in extract_many([os.path.join(folder, file) for file in files]):
+            if pages is None:
+                failed.append(os.path.basename(path))
+                continue
+            yield os.path.basename(path), pages
+    else:
+        get_titles.resolve_titles([ssrn_id_of(file) for file in files], title_cache)
+        for file in files:
+            yield file, None
 
 ############################################################################################################
-# Embed the chunks and store them in a database alongside computed embeddings
-print("Creating the database...")
-try:
-    # db = FAISS.from_documents(docs, OpenAIEmbeddings(api_key=openai_api_key)) # use OpenAI embeddings
-    from langchain_community.embeddings import HuggingFaceBgeEmbeddings
-
-    # Parameters for HF embeddings
-    model_name = "BAAI/bge-base-en-v1.5"
-    model_kwargs = {"device": "cuda"}
-    encode_kwargs = {"normalize_embeddings": False}
-
-    hf = HuggingFaceBgeEmbeddings(
-        model_name=model_name,
-        model_kwargs=model_kwargs,
-        encode_kwargs=encode_kwargs
-    )
-
-    db = FAISS.from_documents(docs, hf)
-    print("Database created successfully.")
-except Exception as e:
-    print(f"Error creating FAISS database: {e}")
-
-# Save the database
-if from_pdf:
-    output_file = "kb/faiss_index_pdf"
-else:
-    output_file = "kb/faiss_index_hf2"
-db.save_local(output_file)
+# Manifest of the files an index was built from, stored next to the index as manifest.json
+
+def load_manifest(index_dir):
+    try:
+        with open(os.path.join(index_dir, "manifest.json"), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
 
+def diff_folder(folder, manifest):
+    """
+    Compare the source folder with the manifest of the existing index.
 
+    Returns:
+        tuple: (files to add, files to remove from the index, file -> (mtime, sha256) for every current file).
+        A changed file is in both lists. Files whose mtime is unchanged are not re-hashed.
+    """
+    current = {}
+    to_add = []
+    for file in source_files(folder):
+        path = os.path.join(folder, file)
+        mtime = os.path.getmtime(path)
+        entry = manifest.get(file)
+        if entry and entry["mtime"] == mtime:
+            current[file] = (mtime, entry["sha256"])
+            continue
+        sha256 = file_sha256(path)
+        current[file] = (mtime, sha256)
+        if not entry or entry["sha256"] != sha256:
+            to_add.append(file)
+    to_remove = [file for file in manifest if file not in current or file in to_add]
+    return to_add, to_remove, current
+
+def save_atomically(db, manifest, output_file):
+    """
+    Write the index and its manifest to a new versioned directory, then atomically repoint the
+    output_file symlink at it, so that a process loading output_file never sees a half-written index.
+    The previous version is kept for processes still reading it; older ones are removed.
+
+    The one-time migration of an index written before versioning (a plain directory) is not atomic: a
+    directory cannot be replaced by a symlink in one step, so output_file is missing between moving the
+    directory aside and renaming the link into its place. Run the first versioned build while nothing loads it.
+    """
+    version_dir = f"{output_file}.v{time.time_ns()}"
+    db.save_local(version_dir)
+    with open(os.path.join(version_dir, "manifest.json"), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+
+    tmp_link = f"{output_file}.tmp-{os.getpid()}"
+    os.symlink(os.path.basename(version_dir), tmp_link)
+    if os.path.isdir(output_file) and not os.path.islink(output_file):
+        # an index written before versioning is a plain directory; move it aside once, right before the
+        # link takes its place, to keep the window without an index as short as possible (see above)
+        os.rename(output_file, f"{output_file}.v0")
+    os.replace(tmp_link, output_file)
+
+    parent = os.path.dirname(output_file) or '.'
+    prefix = os.path.basename(output_file) + ".v"
+    versions = sorted((name for name in os.listdir(parent) if name.startswith(prefix)),
+                      key=lambda name: int(name[len(prefix):]))
+    for name in versions[:-2]:
+        shutil.rmtree(os.path.join(parent, name))
 
 ############################################################################################################
-# Test functionality
+# Embed the chunks and store them in a database alongside computed embeddings. The build is a pipeline of
+# generators (extract -> load and clean -> split -> embed -> index), so only one file's pages and one batch
+# of chunks are held at a time, whatever the size of the corpus.
+
+batch_size = 256 # chunks embedded and added to the index at a time
+
+class StageCounters:
+    """
+    Items and seconds per stage of a generator pipeline. Pulling from a stage also runs the stages before it,
+    so the time of a stage is its measured time minus that of the stage it consumes.
+    """
+
+    def __init__(self):
+        self.items = {}
+        self.seconds = {}
+
+    def count(self, stage, iterable, size=None):
+        """
+        Pass the items of iterable through, timing each pull. size(item) gives the number of items
+        an item stands for, e.g. len for batches.
+        """
+        # registered here rather than in the generator, which only starts running on the first pull
+        self.items[stage] = 0
+        self.seconds[stage] = 0.0
+        return self._count(stage, iter(iterable), size)
+
+    def _count(self, stage, iterator, size):
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.seconds[stage] += time.perf_counter() - start
+                return
+            self.seconds[stage] += time.perf_counter() - start
+            self.items[stage] += size(item) if size else 1
+            yield item
+
+    def report(self):
+        upstream = 0.0
+        for stage, items in self.items.items():
+            seconds = max(self.seconds[stage] - upstream, 0.0)
+            upstream = self.seconds[stage]
+            rate = f"{items / seconds:10.1f} items/s" if seconds > 0 else ""
+            print(f"{stage:<12} {items:8d} items {seconds:9.2f} s {rate}")
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def load_documents(extracted_files):
+    for file, pages in extracted_files:
+        print(file)
+        for doc in load_file(folder, file, pages):
+            yield file, doc
+
+# Chunks of a file get stable docstore ids so that they can be deleted when the file changes. Splitting
+# page by page gives the same chunks as splitting the file's pages together, as the splitter never
+# crosses document boundaries.
+def split_documents(documents, manifest, current):
+    counts = {}
+    for file, doc in documents:
+        if file not in counts:
+            counts[file] = 0
+            manifest[file] = {"mtime": current[file][0], "sha256": current[file][1], "ids": []}
+        for chunk in text_splitter.split_documents([doc]):
+            chunk_id = f"{file}:{counts[file]}"
+            counts[file] += 1
+            manifest[file]["ids"].append(chunk_id)
+            yield chunk, chunk_id
+
+def embed_batches(chunks, embeddings):
+    for batch in batched(chunks, batch_size):
+        vectors = embeddings.embed_documents([chunk.page_content for chunk, _ in batch])
+        yield batch, vectors
+
+def add_batches(embedded, db):
+    for batch, vectors in embedded:
+        db.add_embeddings(
+            [(chunk.page_content, vector) for (chunk, _), vector in zip(batch, vectors)],
+            metadatas=[chunk.metadata for chunk, _ in batch],
+            ids=[chunk_id for _, chunk_id in batch],
+        )
+        yield batch
+
+def add_files(db, files, manifest, current, embeddings):
+    """
+    Run the pipeline over the given files, adding their chunks to db and their entries to manifest.
+    Files without any text get a manifest entry without ids, so they are not reprocessed by every update.
+    PDFs that failed to extract are left out of the manifest, so the next update tries them again.
+    """
+    counters = StageCounters()
+    failed = []
+    stages = counters.count("extract", extracted(folder, files, failed))
+    stages = counters.count("load+clean", load_documents(stages))
+    stages = counters.count("split", split_documents(stages, manifest, current))
+    stages = counters.count("embed", embed_batches(stages, embeddings), size=lambda item: len(item[0]))
+    stages = counters.count("index", add_batches(stages, db), size=len)
+    for _ in stages:
+        pass
+    for file in files:
+        if file not in failed:
+            manifest.setdefault(file, {"mtime": current[file][0], "sha256": current[file][1], "ids": []})
+    if failed:
+        print(f"Skipped {len(failed)} unreadable PDFs: {', '.join(failed)}")
+    counters.report()
+
+def empty_index(embeddings):
+    # the same flat L2 index that FAISS.from_documents creates
+    dim = len(embeddings.embed_query("dimension probe"))
+    return FAISS(embeddings, faiss.IndexFlatL2(dim), InMemoryDocstore(), {})
+
+def build_index(embeddings):
+    db, manifest = empty_index(embeddings), {}
+    current = diff_folder(folder, {})[2]
+    add_files(db, list(current), manifest, current, embeddings)
+    return db, manifest
+
+def update_index(db, manifest, embeddings):
+    to_add, to_remove, current = diff_folder(folder, manifest)
+    print(f"{len(to_add)} new or changed files, {len(set(to_remove) - set(to_add))} removed files")
+
+    stale_ids = [doc_id for file in to_remove for doc_id in manifest[file]["ids"]]
+    if stale_ids:
+        db.delete(stale_ids)
+    manifest = {file: dict(manifest[file], mtime=current[file][0]) for file in current if file not in to_add}
+    add_files(db, to_add, manifest, current, embeddings)
+    return db, manifest
+
 if __name__ == "__main__":
-    # print("got here")
+    print("Creating the database...")
+    try:
+        # db = FAISS.from_documents(docs, OpenAIEmbeddings(api_key=openai_api_key)) # use OpenAI embeddings
+        # HF embeddings on the first GPU if there is one; see embedding_backend.py for the options
+        hf = embedding_backend.make_embeddings()
+        backend = os.environ.get("EMBEDDING_BACKEND", "torch")
+        cache_key = embedding_backend.model_name if backend == "torch" else f"{embedding_backend.model_name}+{backend}"
+
+        # only chunks whose text (or embedding model) changed since the last build are embedded again
+        cache = EmbeddingCache("kb/embedding_cache.sqlite")
+        cached_hf = CachedEmbeddings(hf, cache, cache_key, embedding_backend.encode_kwargs["normalize_embeddings"])
+
+        manifest = load_manifest(output_file) if incremental else None
+        if manifest is not None:
+            db = FAISS.load_local(output_file, cached_hf, allow_dangerous_deserialization=True)
+            db, manifest = update_index(db, manifest, cached_hf)
+        else:
+            db, manifest = build_index(cached_hf)
+        print("Database created successfully.")
+        print(cache.stats())
+    except Exception as e:
+        # nothing is saved, so output_file keeps pointing at the last good version
+        print(f"Error creating FAISS database: {e}")
+        raise
+
+    # Save the database
+    save_atomically(db, manifest, output_file)
+
+    ############################################################################################################
+    # Test functionality
     query = "what is the trolley problem?"
     docs = db.similarity_search(query, k=3)
     for idx, doc in enumerate(docs):
-        print(f"{idx+1}: \n{doc.page_content}\nMETADATA: {doc.metadata}")
\ No newline at end of file
+        print(f"{idx+1}: \n{doc.page_content}\nMETADATA: {doc.metadata}")
@@ -0,0 +1,87 @@
+import argparse
+import gc
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.graph import START, StateGraph
+
+from chat_history import State, one_shot_response
+from checkpointer import SQLiteCheckpointer
+
+# Memory and storage of the chat checkpoints over long conversations: MemorySaver against SQLiteCheckpointer
+# with LangGraph's default serializer and with CompactSerializer. Every turn adds a question, an answer and
+# five retrieved passages to the state of its session, like a turn of chat_history.py, without the LLMs.
+# Run from the repository root: python main_chain/benchmark_checkpointer.py [--sessions 8] [--turns 200]
+
+words = one_shot_response.split()
+
+def text(seed, length):
+    # a different text for every answer and passage, so that compression gains are not overstated
+    rng = random.Random(seed)
+    return " ".join(rng.choice(words) for _ in range(length))
+
+def answer(state: State):
+    seed = state["input"]
+    context = [Document(page_content=text(f"{seed} {i}", 130), metadata={"title": f"Paper {i}"}) for i in range(5)]
+    response = text(seed, 200)
+    return {
+        "chat_history": [HumanMessage(state["input"]), AIMessage(response)],
+        "context": context,
+        "answer": response,
+    }
+
+def make_app(checkpointer):
+    workflow = StateGraph(state_schema=State)
+    workflow.add_edge(START, "model")
+    workflow.add_node("model", answer)
+    return workflow.compile(checkpointer=checkpointer)
+
+def run(name, make_checkpointer, sessions, turns, reports):
+    gc.collect()
+    tracemalloc.start()
+    checkpointer = make_checkpointer()
+    app = make_app(checkpointer)
+    baseline = tracemalloc.get_traced_memory()[0]
+    seconds = 0.0
+    for turn in range(1, turns + 1):
+        start = time.perf_counter()
+        for session in range(sessions):
+            app.invoke({"input": f"Question {turn} of session {session}: what does digital democracy mean?"},
+                       config={"configurable": {"thread_id": f"session-{session}"}})
+        seconds += time.perf_counter() - start
+        if turn in reports:
+            history = app.get_state({"configurable": {"thread_id": "session-0"}}).values["chat_history"]
+            assert len(history) == 2 * turn and isinstance(history[-1], AIMessage), "chat history not restored"
+            gc.collect()
+            memory = (tracemalloc.get_traced_memory()[0] - baseline) / 1e6
+            stored = f"{checkpointer.size()[2] / 1e6:8.2f} MB" if isinstance(checkpointer, SQLiteCheckpointer) else f"{'-':>11}"
+            print(f"{name:<26}{turn:>6}{memory:>12.2f} MB{stored}{seconds / (turn * sessions) * 1000:>10.2f} ms")
+    tracemalloc.stop()
+    return checkpointer
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory of MemorySaver vs the SQLite checkpointer over long conversations.")
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--keep", type=int, default=2, help="checkpoints kept per session by the SQLite checkpointer")
+    args = parser.parse_args()
+
+    reports = {max(1, args.turns * i // 4) for i in range(1, 5)}
+    print(f"{args.sessions} sessions; Python heap growth (tracemalloc), SQLite payload and time per turn")
+    print(f"{'checkpointer':<26}{'turn':>6}{'memory':>15}{'stored':>11}{'per turn':>13}")
+    with tempfile.TemporaryDirectory() as tmp:
+        run("MemorySaver", MemorySaver, args.sessions, args.turns, reports)
+        run("SQLite, default serde", lambda: SQLiteCheckpointer(os.path.join(tmp, "default.sqlite"), keep=args.keep,
+                                                               serde=JsonPlusSerializer()),
+            args.sessions, args.turns, reports).close()
+        checkpointer = run("SQLite, compact serde", lambda: SQLiteCheckpointer(os.path.join(tmp, "compact.sqlite"), keep=args.keep),
+                           args.sessions, args.turns, reports)
+        print(checkpointer.stats())
+        checkpointer.close()
@@ -0,0 +1,86 @@
+import argparse
+import random
+import time
+
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
+from langgraph.graph.message import add_messages
+
+from chat_history import RAG_prompt, contextualize_q_prompt, history_budget, history_turns, one_shot_response
+from history_window import HistoryWindow, default_token_counter
+
+# Prompt size per turn of a long conversation, with the whole chat history in the prompts (as before the history
+# window) and with the history window: the RAG prompt of the answering LLM and the history rewrite prompt of llm2.
+# The summaries are written by llm2 with --llm-url, otherwise by a stand-in that keeps the last max_words words.
+# Run from the repository root: python main_chain/benchmark_history.py [--turns 30] [--llm-url http://10.249.72.3:8000/v1]
+
+words = one_shot_response.split()
+
+def text(seed, length):
+    rng = random.Random(seed)
+    return " ".join(rng.choice(words) for _ in range(length))
+
+def stand_in_summarizer(max_words):
+    def summarize(prompt):
+        human = prompt.to_messages()[-1].content
+        return " ".join(human.split()[-max_words:])
+    return RunnableLambda(summarize)
+
+def prompt_tokens(prompt, state, count):
+    return sum(count(message.content) for message in prompt.format_messages(**state))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prompt tokens per turn with and without the history window.")
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--answer-words", type=int, default=180, help="length of every answer")
+    parser.add_argument("--llm-url", help="summarize with this OpenAI-compatible endpoint (llm2)")
+    args = parser.parse_args()
+
+    if args.llm_url:
+        from llm_clients import chat_model
+        summarizer = chat_model(args.llm_url, api_key='gibberish')
+    else:
+        summarizer = stand_in_summarizer(150)
+    count = default_token_counter()
+    window = HistoryWindow(summarizer, budget=history_budget, keep_turns=history_turns, count_tokens=count)
+    context = [Document(page_content=text(f"passage {i}", 130)) for i in range(5)]
+    context_text = "\n\n".join(doc.page_content for doc in context)
+
+    full = {"chat_history": []}
+    windowed = {"chat_history": [], "summary": ""}
+    totals = {"full": 0, "windowed": 0}
+    print(f"history window: {history_turns} turns, {history_budget} tokens; prompt tokens per turn")
+    print(f"{'turn':>4}{'RAG full':>10}{'RAG window':>12}{'rewrite full':>14}{'rewrite window':>16}{'summary':>9}")
+    for turn in range(1, args.turns + 1):
+        question = f"Question {turn}: " + text(f"question {turn}", 15)
+        answer = text(f"answer {turn}", args.answer_words)
+        inputs = {"input": question, "context": context_text}
+        windowed_history = window.messages(windowed)
+        rag_full = prompt_tokens(RAG_prompt, {**inputs, "chat_history": full["chat_history"]}, count)
+        rag_window = prompt_tokens(RAG_prompt, {**inputs, "chat_history": windowed_history}, count)
+        rewrite_full = prompt_tokens(contextualize_q_prompt, {"input": question, "chat_history": full["chat_history"]}, count)
+        rewrite_window = prompt_tokens(contextualize_q_prompt, {"input": question, "chat_history": windowed_history}, count)
+        totals["full"] += rag_full + rewrite_full
+        totals["windowed"] += rag_window + rewrite_window
+        print(f"{turn:>4}{rag_full:>10}{rag_window:>12}{rewrite_full:>14}{rewrite_window:>16}{count(windowed.get('summary', '')):>9}")
+
+        new_messages = [HumanMessage(question), AIMessage(answer)]
+        full["chat_history"] = add_messages(full["chat_history"], new_messages)
+        update = window.fold(windowed, new_messages)
+        windowed = {"chat_history": add_messages(windowed["chat_history"], update["chat_history"]),
+                    "summary": update.get("summary", windowed["summary"])}
+
+    print(f"total prompt tokens over {args.turns} turns: {totals['full']} with the whole history, "
+          f"{totals['windowed']} with the window ({1 - totals['windowed'] / totals['full']:.0%} fewer)")
+    print(window.stats())
+
+    # counting the history of a turn, with the token counts cached per message and from scratch
+    history = full["chat_history"]
+    start = time.perf_counter()
+    sum(window.tokens(message) for message in history)
+    cached = time.perf_counter() - start
+    start = time.perf_counter()
+    sum(count(message.content) for message in history)
+    uncached = time.perf_counter() - start
+    print(f"counting {len(history)} messages: {cached * 1000:.2f} ms with cached counts, {uncached * 1000:.2f} ms from scratch")
@@ -0,0 +1,84 @@
+import argparse
+import os
+import random
+import statistics
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from chat_history import RAG_prompt, RAG_prompt_stable_prefix, history_turns, one_shot_response
+from stub_server import PrefixCache, StubHandler
+
+# Time to first token of the answer with RAG_prompt (static instructions after the chat history) and with
+# RAG_prompt_stable_prefix (all static content first), for several sessions taking turns as at a live event,
+# each with its own chat history and retrieved passages. By default against kb/stub_server.py, started in this
+# process, which simulates prefill time and prefix caching; with --url against a real server (the layouts then
+# share the cache of the persona and the examples, so the first turns are left out of the medians).
+# Run from the repository root: python main_chain/benchmark_prompt_prefix.py [--sessions 4] [--turns 8] [--url http://localhost:8080/v1]
+
+words = one_shot_response.split()
+
+def text(seed, length):
+    rng = random.Random(seed)
+    return " ".join(rng.choice(words) for _ in range(length))
+
+def first_token(llm, messages):
+    start = time.perf_counter()
+    for chunk in llm.stream(messages):
+        if chunk.content:
+            return time.perf_counter() - start
+    return time.perf_counter() - start
+
+def run(name, prompt, llm, args):
+    if StubHandler.prefix_cache is not None:
+        StubHandler.prefix_cache = PrefixCache(args.cache_blocks)
+        StubHandler.stats.update(prompt_tokens=0, cached_tokens=0)
+    histories = [[] for _ in range(args.sessions)]
+    rendered = []
+    ttft = []
+    for turn in range(1, args.turns + 1):
+        for session in range(args.sessions):
+            question = "question: " + text(f"question {session} {turn}", 15)
+            context = "\n\n".join(text(f"passage {session} {turn} {i}", 130) for i in range(5))
+            messages = prompt.format_messages(chat_history=histories[session][-2 * history_turns:], context=context, input=question)
+            rendered.append("".join(f"{message.type}: {message.content}\n" for message in messages))
+            seconds = first_token(llm, messages)
+            if turn > 1:
+                ttft.append(seconds)
+            histories[session] += [HumanMessage(question), AIMessage(text(f"answer {session} {turn}", 180))]
+
+    shared = len(os.path.commonprefix(rendered))
+    line = (f"{name:<16}{statistics.median(ttft) * 1000:>10.0f} ms{statistics.quantiles(ttft, n=10)[-1] * 1000:>10.0f} ms"
+            f"{shared:>14} chars")
+    if StubHandler.prefix_cache is not None:
+        line += f"{StubHandler.stats['cached_tokens'] / StubHandler.stats['prompt_tokens']:>12.0%}"
+    print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time to first token of the interleaved and the stable-prefix RAG prompt.")
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--turns", type=int, default=8)
+    parser.add_argument("--url", help="OpenAI-compatible endpoint to measure instead of the simulated one")
+    parser.add_argument("--prefill-rate", type=float, default=2000, help="simulated prompt tokens prefilled per second")
+    parser.add_argument("--cache-blocks", type=int, default=4096, help="16-token blocks of simulated prefix cache")
+    args = parser.parse_args()
+
+    from llm_clients import chat_model
+    if args.url:
+        url = args.url
+    else:
+        StubHandler.latency = 0.02
+        StubHandler.prefill_rate = args.prefill_rate
+        StubHandler.prefix_cache = PrefixCache(args.cache_blocks)
+        server = ThreadingHTTPServer(("localhost", 0), StubHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://localhost:{server.server_address[1]}/v1"
+        print(f"simulated server: {args.prefill_rate:.0f} prompt tokens/s, prefix cache of {args.cache_blocks} blocks")
+    llm = chat_model(url, api_key='gibberish', max_tokens=1)
+
+    print(f"{args.sessions} sessions x {args.turns} turns, time to first token after the first turn")
+    print(f"{'layout':<16}{'median':>13}{'p90':>13}{'shared prefix':>20}" + (f"{'cached':>12}" if not args.url else ""))
+    run("interleaved", RAG_prompt, llm, args)
+    run("stable prefix", RAG_prompt_stable_prefix, llm, args)
@@ -0,0 +1,79 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from relevance import RelevanceClassifier, discriminator_template, load_examples, log_pattern
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "kb"))
+from embedding_backend import make_embeddings
+
+# Compare the local relevance classifier with the LLM discriminator whose logged answers it is trained on:
+# cross-validated agreement and the share of questions it answers without the LLM per confidence level,
+# then latency per question. Run from the repository root:
+#   python main_chain/benchmark_relevance.py [--llm-url http://10.249.72.3:8000/v1]
+
+confidences = [0.6, 0.7, 0.8, 0.9, 0.95]
+
+def cross_validated_probabilities(classifier, vectors, labels, n_splits):
+    from sklearn.model_selection import StratifiedKFold
+
+    probabilities = np.zeros(len(labels))
+    for train, test in StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=0).split(vectors, labels):
+        classifier.fit(None, labels[train], vectors=vectors[train])
+        probabilities[test] = classifier.probabilities(vectors[test])
+    return probabilities
+
+def ms_per_question(fn, questions):
+    start = time.perf_counter()
+    for question in questions:
+        fn(question)
+    return (time.perf_counter() - start) / len(questions) * 1000
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Accuracy and latency of the local relevance classifier.")
+    parser.add_argument("--llm-url", help="also time the LLM discriminator at this OpenAI-compatible endpoint")
+    parser.add_argument("--llm-questions", type=int, default=20, help="questions sent to the LLM discriminator")
+    args = parser.parse_args()
+
+    questions, labels = load_examples()
+    labels = np.array(labels)
+    n_splits = min(5, int(labels.sum()), int((~labels).sum()))
+    if n_splits < 2:
+        sys.exit(f"Need at least 2 relevant and 2 irrelevant logged questions in {log_pattern}, "
+                 f"found {labels.sum()} and {(~labels).sum()}")
+    print(f"{len(questions)} labelled questions, {labels.sum()} relevant")
+
+    embeddings = make_embeddings()
+    classifier = RelevanceClassifier(embeddings)
+    vectors = classifier.embed(questions)
+    probabilities = cross_validated_probabilities(classifier, vectors, labels, n_splits)
+    print(f"local classifier, {n_splits}-fold cross-validated agreement with the LLM discriminator:")
+    for confidence in confidences:
+        confident = np.maximum(probabilities, 1 - probabilities) >= confidence
+        correct = (probabilities >= 0.5) == labels
+        local_accuracy = correct[confident].mean() if confident.any() else float("nan")
+        # questions the classifier is not confident about go to the LLM, which agrees with itself
+        overall = (correct & confident).sum() / len(labels) + (~confident).mean()
+        print(f"  confidence {confidence:.2f}: {confident.mean():6.1%} answered locally, "
+              f"{local_accuracy:6.1%} of them correct, {overall:6.1%} correct with LLM fallback")
+
+    classifier.fit(None, labels, vectors=vectors)
+    vector_ms = ms_per_question(lambda q: classifier.probabilities(vectors[0]), questions)
+    embed_ms = ms_per_question(classifier.probability, questions)
+    print(f"local classifier: {vector_ms:.3f} ms/question on a cached query embedding, "
+          f"{embed_ms:.1f} ms/question including the embedding")
+
+    if args.llm_url:
+        from llm_clients import chat_model
+
+        discriminator = chat_model(args.llm_url, api_key='gibberish')
+        sample = questions[:args.llm_questions]
+        answers = []
+        llm_ms = ms_per_question(
+            lambda q: answers.append(discriminator.invoke(discriminator_template.format_messages(user_question=q)).content == 'Yes.'),
+            sample)
+        agreement = np.mean(np.array(answers) == labels[:len(sample)])
+        print(f"LLM discriminator: {llm_ms:.1f} ms/question, {agreement:.1%} agreement with its logged answers")
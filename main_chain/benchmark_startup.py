@@ -0,0 +1,63 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+# Cold-start cost of chat_history.py, measured in fresh processes: the import, the load of the embedder and
+# of the index, the LLM clients, chains and graph, and the first query (its embedding and FAISS search; with
+# --turn the whole first turn, which needs the LLM endpoints). Compares loading everything one after the
+# other, as chat_history.py used to at import time, with the parallel background warm-up.
+# Run from the repository root: python main_chain/benchmark_startup.py [--runs 3] [--turn]
+
+question = "What does digital democracy mean?"
+
+def measure(mode, turn):
+    """
+    Runs in the child process; prints the startup timings as JSON.
+    """
+    import chat_history
+
+    service = chat_history.service
+    if mode == "parallel":
+        service.warm_up()
+        service.wait()
+    else:
+        for name in ("embedder", "retriever", "clients", "app", "relevance_classifier", "semantic_cache"):
+            service.get(name)
+        service.record("ready", time.perf_counter() - chat_history.import_started)
+    start = time.perf_counter()
+    if turn:
+        service.app.invoke({"input": question}, config={"configurable": {"thread_id": "benchmark"}})
+    else:
+        service.retriever.invoke(question)
+    service.record("first query", time.perf_counter() - start)
+    print(json.dumps(service.timings))
+
+def run(mode, turn):
+    child = subprocess.run([sys.executable, __file__, "--child", mode] + (["--turn"] if turn else []),
+                           capture_output=True, text=True, check=True)
+    return json.loads(child.stdout.strip().splitlines()[-1])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Startup time of chat_history.py, sequential vs parallel warm-up.")
+    parser.add_argument("--runs", type=int, default=3, help="fresh processes per mode")
+    parser.add_argument("--turn", action="store_true", help="time a whole first turn instead of the first retrieval")
+    parser.add_argument("--child", choices=["sequential", "parallel"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        measure(args.child, args.turn)
+        sys.exit()
+
+    modes = ["sequential", "parallel"]
+    results = {mode: [run(mode, args.turn) for _ in range(args.runs)] for mode in modes}
+    print(f"median of {args.runs} fresh processes, seconds")
+    print(f"{'stage':<16}" + "".join(f"{mode:>12}" for mode in modes))
+    from chat_history import ChatService
+    for stage, label in ChatService.stages:
+        medians = [statistics.median(timings[stage] for timings in results[mode]) if stage in results[mode][0] else None
+                   for mode in modes]
+        if any(median is not None for median in medians):
+            print(f"{label:<16}" + "".join(f"{median:>12.2f}" if median is not None else f"{'-':>12}" for median in medians))
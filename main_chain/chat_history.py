@@ -1,3 +1,6 @@
+import time
+import_started = time.perf_counter() # the startup report times the import of this module from here
+
 from langchain_core.prompts import (
     ChatPromptTemplate,
     MessagesPlaceholder,
@@ -5,40 +8,32 @@ from langchain_core.prompts import (
 )
 from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
 from langgraph.graph.message import add_messages
-from langchain_openai import ChatOpenAI
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables import RunnableLambda
 
-from langchain_community.vectorstores import FAISS
 from typing import Sequence
-from langchain_core.documents.base import Document
+
+import asyncio
+import gc
+import threading
+import uuid
+from concurrent.futures import Future
 
 # imports for logging sessions to txt
 import os
 import sys
 from chat_logging import ConsoleLogger, read_and_update_session_number
+from query_cache import CachedQueryEmbeddings, CachedRetriever, QueryCache, index_version
+from query_rewrite import QueryRewriter
+from history_window import HistoryWindow
+from relevance import RelevanceClassifier, discriminator_template
 
-# open source embeddings
-from langchain_community.embeddings import HuggingFaceBgeEmbeddings
-
-# HF embeddings parameters
-model_name = "BAAI/bge-base-en-v1.5"
-model_kwargs = {"device": "cpu"}
-encode_kwargs = {"normalize_embeddings": False}
-
-hf = HuggingFaceBgeEmbeddings(
-    model_name=model_name,
-    model_kwargs=model_kwargs,
-    encode_kwargs=encode_kwargs
-)
-from langchain.chains import (
-    create_history_aware_retriever,
-    create_retrieval_chain
-)
-from langchain.chains.combine_documents import create_stuff_documents_chain
+# shared modules in kb/ (embedding factory, LLM clients)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "kb"))
 from typing_extensions import Annotated, TypedDict
-from langgraph.graph import START, StateGraph
-from langgraph.checkpoint.memory import MemorySaver
+
+# The embedder (torch), the FAISS index, the LLM clients and the chains are not created at import time but by
+# the ChatService below, on first use or in the background (warm_up); their imports are deferred with them.
 
 #####################################################################################################################
 
@@ -72,7 +67,8 @@ off_topic_response = """
 I appreciate your interest in cooking, but I don't think it's really relevant to my work. Let's try not to let our discussion wander.
 """
 
-RAG_prompt = ChatPromptTemplate([
+# the static part shared by both prompt layouts below: the persona and the example interactions
+example_messages = [
     ("system", system_prompt),
     ("system", "Here are some example interactions. These are NOT part of the chat history with the current user. Do not include these interactions as part of the conversation history:\n"),
     # ("human", off_topic_query),
@@ -83,28 +79,49 @@ RAG_prompt = ChatPromptTemplate([
     ("ai", "As a professor of computational social science, I'm driven by a desire to understand the intricacies of human behavior and how it shapes our societies. I find it fascinating to explore the complex interplay between individual motivations, social influences, and collective outcomes. For me, the drive for information and understanding is a key motivator. I'm constantly seeking to learn more about the world around me and to uncover new insights that can help us better navigate the complexities of human behavior."),
     ("human", one_shot_query),
     ("ai", one_shot_response),
+]
+
+# how to answer a question, also shared by both layouts
+response_instructions = "You are provided with passages from your work delimited by 'retrieval:'. Do not mention 'retrievals' in your response; the user is unaware that you are provided passages. If you are not provided with any retrieval, you may still respond. You may also admit that you are not prepared to answer such a question. If you do respond without any retrieval, admit that you are not particularly well-informed on the subject matter and that the response you give is your best guess. Keep in mind that the text of your response will be spoken aloud. If asked to provide code, provide verbal pseudocode instead."
+
+RAG_prompt = ChatPromptTemplate(example_messages + [
     ("system", "The above consists only of example interaction. DO NOT MENTION ANY PRECEDING INTERACTIONS TO THE USER. As far as the user is concerned, the chat history between you and the user begins from here onwards. If the user asks about the conversation history, only mention the following interactions:\n"),
     MessagesPlaceholder("chat_history"),
-    ("system", "Now you are asked a new question, delimited by 'question:'. You are provided with passages from your work delimited by 'retrieval:'. Do not mention 'retrievals' in your response; the user is unaware that you are provided passages. If you are not provided with any retrieval, you may still respond. You may also admit that you are not prepared to answer such a question. If you do respond without any retrieval, admit that you are not particularly well-informed on the subject matter and that the response you give is your best guess. Keep in mind that the text of your response will be spoken aloud. If asked to provide code, provide verbal pseudocode instead.\n"),
+    ("system", f"Now you are asked a new question, delimited by 'question:'. {response_instructions}\n"),
     ("human", rag_retrieval),
     ("system", "Respond in your usual style.")
 ])
 
+# The same prompt with all static content (persona, example interactions and instructions) in one prefix that
+# is identical for every turn of every session, followed by the dynamic content: the summary and chat history,
+# then the retrieval and the question. Local servers with prefix caching (llama.cpp, vLLM with
+# --enable-prefix-caching) reuse the KV cache of the prefix and only prefill what follows it. Nothing that
+# varies (dates, names, session ids) may go into the prefix, or it is no longer shared. Edit the prompt through
+# system_prompt, example_messages and response_instructions, which both layouts are built from.
+RAG_prompt_stable_prefix = ChatPromptTemplate(example_messages + [
+    ("system", "The above consists only of example interaction. DO NOT MENTION ANY PRECEDING INTERACTIONS TO THE USER. As far as the user is concerned, the chat history between you and the user begins after this message. If the user asks about the conversation history, only mention the interactions that follow.\n"
+               f"Each new question is delimited by 'question:'. {response_instructions} Respond in your usual style.\n"),
+    MessagesPlaceholder("chat_history"),
+    ("human", rag_retrieval),
+])
+
 #####################################################################################################################
 
 # http://10.249.72.3:8000/v1 - this computer (used for 8B summarization right now)
 # http://10.249.72.3:8080/v1 - euler (used for 70B digital dirk right now)
 
-# setup llama instance for digital twin
-llm = ChatOpenAI(base_url='http://localhost:8080/v1', api_key='gibberish')
+# llama instance for digital twin
+llm_url = 'http://localhost:8080/v1'
 
-
-# setup llama instance for chat history summarization/discriminator - weaker model necessary to improve response time
-llm2 = ChatOpenAI(base_url='http://10.249.72.3:8000/v1', api_key='gibberish')
+# llama instance for chat history summarization/discriminator - weaker model necessary to improve response time
+llm2_url = 'http://10.249.72.3:8000/v1'
 
 # choose the db to use (see kb/vector_store.py)
-db = FAISS.load_local("kb/faiss_index_hf2", hf, allow_dangerous_deserialization=True)
-retriever = db.as_retriever(search_type="similarity_score_threshold", search_kwargs={"score_threshold": 0.4, "k": 5})
+index_path = "kb/faiss_index_hf2"
+
+# chat histories are checkpointed to SQLite (see checkpointer.py), so sessions survive a restart and are shared by
+# the workers of chat_server.py; None keeps them in memory (MemorySaver) for the lifetime of the process instead
+checkpoint_path = "main_chain/checkpoints.sqlite"
 
 # prompt to summarize chat history
 contextualize_q_system_prompt = (
@@ -123,17 +140,23 @@ contextualize_q_prompt = ChatPromptTemplate.from_messages(
     ]
 )
 
-# outputs the list of documents retrieved based on recontextualized prompt
-history_aware_retriever = create_history_aware_retriever(
-    llm2, retriever, contextualize_q_prompt
-    # used to be llm
-)
+# opt-in: reuse the answer (and retrieved context) given to an earlier, near-identical standalone question,
+# e.g. repeated audience questions at live events, instead of calling the LLMs again
+use_semantic_cache = False
 
-# see RAG_prompt above - this prompts the main LLM to respond given kb retrievals
-question_answer_chain = create_stuff_documents_chain(llm, RAG_prompt) 
+# local relevance classifier over the query embedding (see relevance.py); the LLM discriminator is only
+# asked when it is not confident
+use_local_discriminator = True
 
-# retrieve based on chat history and respond based on prompt
-rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
+# the prompts get the last turns verbatim (at most history_turns turns and history_budget tokens) and a running
+# summary of the older ones, instead of the whole conversation (see history_window.py); False passes it all
+use_history_window = True
+history_turns = 4
+history_budget = 1500
+
+# RAG_prompt_stable_prefix instead of RAG_prompt, so that the servers can reuse the prompt prefix across turns
+# and sessions (see python main_chain/benchmark_prompt_prefix.py)
+use_stable_prompt_prefix = True
 
 ##### lang graph to handle chat history #####
 
@@ -142,35 +165,316 @@ rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chai
 class State(TypedDict):
     input: str
     chat_history: Annotated[Sequence[BaseMessage], add_messages]
+    summary: str # of the turns folded out of chat_history by the history window
     context: str
     answer: str
 
+class DeferredEmbeddings(Embeddings):
+    """
+    Stands in for the embedder while it is still loading, so that the index can be loaded at the same time;
+    the first embed waits for the model.
+    """
+
+    def __init__(self, load):
+        self.load = load
+
+    def embed_documents(self, texts):
+        return self.load().embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.load().embed_query(text)
+
+class ChatService:
+    """
+    The heavy parts of the chat loop, each created once, on first use: the embedder, the FAISS index, the LLM
+    clients, the chains and the LangGraph app. Importing this module therefore only defines prompts and functions.
+
+    warm_up() loads them in background threads, the embedder in parallel with the index, so they are usually
+    ready by the time the first question is asked. For a pre-forking server, preload() loads only the embedder
+    and the index, which are read-only afterwards and so stay shared between the forked workers, while the LLM
+    clients (with their connection pools) and the app are created in each worker.
+    """
+
+    # (component, label in the startup report); each component is built by the load_<component> method
+    stages = [("import", "import"), ("embedder", "model load"), ("embedder warm-up", "model warm-up"),
+              ("retriever", "index load"), ("clients", "LLM clients"), ("chains", "chains"), ("app", "graph"),
+              ("ready", "ready"), ("first query", "first query")]
+    # components loaded before another one, so that its load time does not include theirs
+    requires = {"chains": ("retriever", "clients"), "app": ("chains",)}
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.timings = {}
+        self.components = {}
+        self.lock = threading.Lock()
+        self.warm_up_threads = []
+        # query embeddings and retrievals are cached, so a query is embedded and searched once per turn
+        # (the discriminator and the history-aware retriever both retrieve) and repeated questions are answered locally
+        self.embedding_cache = QueryCache("query embedding", max_entries=1024, ttl=3600)
+        self.retrieval_cache = QueryCache("retrieval", max_entries=1024, ttl=600)
+        self.cached_hf = CachedQueryEmbeddings(DeferredEmbeddings(lambda: self.get("embedder")), self.embedding_cache)
+
+    def get(self, name):
+        """
+        The component, loaded by the first caller; concurrent callers wait for that load instead of repeating it.
+        A failed load raises its exception again wherever the component is used.
+        """
+        with self.lock:
+            future = self.components.get(name)
+            loading = future is None
+            if loading:
+                future = self.components[name] = Future()
+        if loading:
+            try:
+                for required in self.requires.get(name, ()):
+                    self.get(required)
+                start = time.perf_counter()
+                component = getattr(self, f"load_{name}")()
+                self.timings[name] = time.perf_counter() - start
+                future.set_result(component)
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result()
+
+    def loaded(self, name):
+        future = self.components.get(name)
+        return future is not None and future.done() and future.exception() is None
+
+    def record(self, stage, seconds):
+        self.timings.setdefault(stage, seconds)
+
+    def load_embedder(self):
+        # open source embeddings, created by the shared factory in kb/ (device, threads and backend are configurable)
+        from embedding_backend import make_embeddings
+        return make_embeddings()
+
+    def load_index(self):
+        from langchain_community.vectorstores import FAISS
+        db = FAISS.load_local(self.index_path, self.cached_hf, allow_dangerous_deserialization=True)
+        return db.as_retriever(search_type="similarity_score_threshold", search_kwargs={"score_threshold": 0.4, "k": 5})
+
+    def load_retriever(self):
+        # rebuilding the index (kb/vector_store.py) invalidates the retrieval cache and reloads the index
+        return CachedRetriever(retriever=self.load_index(), cache=self.retrieval_cache,
+                               version=lambda: index_version(self.index_path), reload=self.load_index,
+                               current_version=index_version(self.index_path))
+
+    def load_clients(self):
+        # one keep-alive connection pool per endpoint (see kb/llm_clients.py); llm2 and the discriminator are one client
+        from llm_clients import registry
+        return {
+            # tokens of this model are the answer, which chat_server.py streams to clients
+            "llm": registry.chat_model(llm_url, api_key='gibberish', metadata={"chat_answer": True}),
+            "llm2": registry.chat_model(llm2_url, api_key='gibberish'),
+            "discriminator": registry.chat_model(llm2_url, api_key='gibberish'),
+        }
+
+    def load_chains(self):
+        from langchain.chains import create_retrieval_chain
+        from langchain.chains.combine_documents import create_stuff_documents_chain
+
+        # outputs the list of documents retrieved based on recontextualized prompt; the llm2 rewrite is skipped
+        # on the first turn and for follow-ups that are already standalone questions (see query_rewrite.py)
+        query_rewriter = QueryRewriter(self.llm2, contextualize_q_prompt) # used to be llm
+        history_aware_retriever = query_rewriter.history_aware_retriever(self.retriever)
+
+        # see RAG_prompt above - this prompts the main LLM to respond given kb retrievals
+        question_answer_chain = create_stuff_documents_chain(self.llm, RAG_prompt_stable_prefix if use_stable_prompt_prefix else RAG_prompt)
+
+        # retrieve based on chat history and respond based on prompt
+        rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
+
+        # older turns are summarized by llm2 after a turn has been answered
+        history_window = HistoryWindow(self.llm2, budget=history_budget, keep_turns=history_turns) if use_history_window else None
+        return {"query_rewriter": query_rewriter, "question_answer_chain": question_answer_chain, "rag_chain": rag_chain,
+                "history_window": history_window}
+
+    def load_app(self):
+        from langgraph.graph import START, StateGraph
+        from langgraph.checkpoint.memory import MemorySaver
+
+        # Our graph consists only of one node:
+        workflow = StateGraph(state_schema=State)
+        workflow.add_edge(START, "model")
+        workflow.add_node("model", RunnableLambda(call_model, afunc=acall_model))
+
+        # Finally, we compile the graph with a checkpointer object.
+        # This persists the state, in SQLite (the last checkpoints of every session) or in memory.
+        if checkpoint_path:
+            from checkpointer import SQLiteCheckpointer
+            memory = SQLiteCheckpointer(checkpoint_path)
+        else:
+            memory = MemorySaver()
+        return workflow.compile(checkpointer=memory)
+
+    def load_relevance_classifier(self):
+        # None when disabled or not trained yet
+        return RelevanceClassifier.load(self.cached_hf) if use_local_discriminator else None
+
+    def load_semantic_cache(self):
+        from semantic_cache import SemanticCache
+        return SemanticCache(self.cached_hf, version=lambda: index_version(self.index_path)) if use_semantic_cache else None
+
+    hf = property(lambda self: self.get("embedder"))
+    retriever = property(lambda self: self.get("retriever"))
+    llm = property(lambda self: self.get("clients")["llm"])
+    llm2 = property(lambda self: self.get("clients")["llm2"])
+    discriminator = property(lambda self: self.get("clients")["discriminator"])
+    query_rewriter = property(lambda self: self.get("chains")["query_rewriter"])
+    question_answer_chain = property(lambda self: self.get("chains")["question_answer_chain"])
+    rag_chain = property(lambda self: self.get("chains")["rag_chain"])
+    history_window = property(lambda self: self.get("chains")["history_window"])
+    app = property(lambda self: self.get("app"))
+    relevance_classifier = property(lambda self: self.get("relevance_classifier"))
+    semantic_cache = property(lambda self: self.get("semantic_cache"))
+
+    def warm_up_embedder(self):
+        # the first encode initializes the backend (CUDA context, ONNX session, thread pools), so run one now
+        self.get("embedder")
+        start = time.perf_counter()
+        self.hf.embed_query("warm up")
+        self.timings["embedder warm-up"] = time.perf_counter() - start
+
+    def warm_up(self):
+        """
+        Load the embedder, the index, the LLM clients and the app in background threads. Returns immediately;
+        whatever is used before it has finished loading waits for it.
+        """
+        def load(name):
+            try:
+                if name == "embedder":
+                    self.warm_up_embedder()
+                else:
+                    self.get(name)
+            except Exception:
+                pass # raised again where the component is used
+
+        self.warm_up_threads = [
+            threading.Thread(target=load, args=(name,), daemon=True, name=f"warm-up {name}")
+            for name in ("embedder", "retriever", "clients", "app", "relevance_classifier", "semantic_cache")
+        ]
+        for thread in self.warm_up_threads:
+            thread.start()
+        threading.Thread(target=self.wait, daemon=True, name="warm-up done").start()
+
+    def wait(self):
+        """
+        Wait for the warm-up to finish and record when everything was ready.
+        """
+        for thread in self.warm_up_threads:
+            thread.join()
+        self.record("ready", time.perf_counter() - import_started)
+
+    def preload(self):
+        """
+        Load the embedder and the index in this process before it forks workers. No thread is started and no
+        query is embedded (torch's thread pools do not survive a fork), and gc.freeze() moves everything loaded
+        so far out of the garbage collector's reach, so that collections in the workers do not write to, and
+        thereby copy, the memory pages they share with this process.
+        """
+        self.get("embedder")
+        self.get("retriever")
+        gc.freeze()
+
+    def report(self):
+        """
+        One line with the time of every startup stage measured so far. The components load in parallel
+        during the warm-up, so 'ready' (seconds from the start of the import) is less than their sum.
+        """
+        stages = [f"{label} {self.timings[stage]:.2f} s" for stage, label in self.stages if stage in self.timings]
+        return f"Startup: {', '.join(stages) if stages else 'nothing loaded'}"
+
+service = ChatService(index_path)
+
+# the components formerly created at import time (chat_history.app, chat_history.retriever, ...) are those of the service
+def __getattr__(name):
+    if isinstance(getattr(ChatService, name, None), property):
+        return getattr(service, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# the state as the chains see it: the chat history reduced to the history window
+def prompt_state(state):
+    window = service.history_window
+    return {**state, "chat_history": window.messages(state) if window is not None else state.get("chat_history") or []}
+
+# the state update of a turn: its question and answer are added to the chat history, and the oldest turns
+# are folded into the summary when the history window is exceeded
+def turn_update(state, answer):
+    new_messages = [HumanMessage(state["input"]), AIMessage(answer)]
+    window = service.history_window
+    return window.fold(state, new_messages) if window is not None else {"chat_history": new_messages}
+
+async def aturn_update(state, answer):
+    new_messages = [HumanMessage(state["input"]), AIMessage(answer)]
+    window = service.history_window
+    return await window.afold(state, new_messages) if window is not None else {"chat_history": new_messages}
+
+# rag_chain, with the answer looked up in the semantic cache first and stored there afterwards. Refused turns
+# (irrelevant_prompt) bypass it: their answers are refusals and must not be served for the question itself.
+def cached_rag_response(state):
+    chat_history = state.get("chat_history") or []
+    question = service.query_rewriter({**state, "chat_history": chat_history})
+    hit = service.semantic_cache.lookup(question)
+    if hit is not None:
+        print(hit["answer"])
+        print(f"(answer cached for '{hit['question']}', similarity {hit['similarity']:.3f})")
+        return {"answer": hit["answer"], "context": hit["context"]}
+    context = service.retriever.invoke(question)
+    response = stream_output({**state, "chat_history": chat_history, "context": context}, service.question_answer_chain)
+    if response["answer"]:
+        service.semantic_cache.store(question, response["answer"], context)
+    return {"answer": response["answer"], "context": context}
+
+# Async version of cached_rag_response for acall_model: the answer is streamed from question_answer_chain.astream
+# inside the graph node, so that its tokens reach the graph's "messages" stream (chat_server.py) instead of
+# being printed; a cached answer is only returned with the node's update.
+async def acached_rag_response(state):
+    chat_history = state.get("chat_history") or []
+    question = await asyncio.to_thread(service.query_rewriter, {**state, "chat_history": chat_history})
+    hit = await asyncio.to_thread(service.semantic_cache.lookup, question)
+    if hit is not None:
+        return {"answer": hit["answer"], "context": hit["context"]}
+    context = await service.retriever.ainvoke(question)
+    answer = ""
+    async for chunk in service.question_answer_chain.astream({**state, "chat_history": chat_history, "context": context}):
+        answer += chunk
+    if answer:
+        await asyncio.to_thread(service.semantic_cache.store, question, answer, context)
+    return {"answer": answer, "context": context}
 
 # We then define a simple node that runs the `rag_chain`.
 # The `return` values of the node update the graph state, so here we just
 # update the chat history with the input message and response.
 def call_model(state: State):
-    response = stream_output(state, rag_chain)
+    if use_semantic_cache and not refused(state["input"]):
+        response = cached_rag_response(prompt_state(state))
+    else:
+        response = stream_output(prompt_state(state), service.rag_chain)
     # response = rag_chain.invoke(state)
     # print(response["context"])
     return {
-        "chat_history": [
-            HumanMessage(state["input"]),
-            AIMessage(response["answer"]),
-        ],
+        **turn_update(state, response["answer"]),
         "context": response["context"],
         "answer": response["answer"],
     }
 
-# Our graph consists only of one node:
-workflow = StateGraph(state_schema=State)
-workflow.add_edge(START, "model")
-workflow.add_node("model", call_model)
-
-# Finally, we compile the graph with a checkpointer object.
-# This persists the state, in this case in memory.
-memory = MemorySaver()
-app = workflow.compile(checkpointer=memory)
+# Async version of call_model, used when the app runs with ainvoke/astream (chat_server.py): the answer
+# is not printed here but streamed to the client from the graph's "messages" stream.
+async def acall_model(state: State):
+    if use_semantic_cache and not refused(state["input"]):
+        response = await acached_rag_response(prompt_state(state))
+    else:
+        response = {"answer": "", "context": []}
+        async for chunk in service.rag_chain.astream(prompt_state(state)):
+            if 'answer' in chunk:
+                response["answer"] += chunk['answer']
+            elif 'context' in chunk:
+                response["context"] = chunk['context']
+    return {
+        **await aturn_update(state, response["answer"]),
+        "context": response["context"],
+        "answer": response["answer"],
+    }
 
 # insert into the call model function above; allows output to stream rather than waiting for entire response
 def stream_output(state, chain): 
@@ -178,7 +482,10 @@ def stream_output(state, chain):
         answer = ""
         context =[]
         for chunk in chain.stream(state):
-            if 'answer' in chunk:
+            if isinstance(chunk, str): # chains without retrieval stream the answer text itself
+                print(chunk, end="", flush=True)
+                answer += chunk
+            elif 'answer' in chunk:
                 print(chunk['answer'], end="", flush=True)
                 answer += chunk['answer']
             elif 'context' in chunk:
@@ -191,56 +498,106 @@ def stream_output(state, chain):
     
 # for higher levels of restrictiveness - 1: llm will only respond to 'on-topic' questions
 #                                        2: llm will only respond if the question hits in the knowledge base
-def query_discriminator(query, restrictiveness):
+irrelevant_prompt = PromptTemplate(
+    input_variables=["question"], 
+    template="A user has asked you: '{question}'. This is not something you are concerned with answering. Express to the user in your own words, briefly and succintly without elaboration, that you are not willing to discuss this topic."
+)
+refusal_prefix, refusal_suffix = irrelevant_prompt.template.split("{question}")
+
+def refused(turn_input):
+    # whether the input of a turn is irrelevant_prompt, i.e. the discriminator turned the question down
+    return turn_input.startswith(refusal_prefix) and turn_input.endswith(refusal_suffix)
+
+def local_relevance(query):
+    if service.relevance_classifier is None:
+        return None
+    relevant = service.relevance_classifier.predict(query)
+    if relevant is not None:
+        print(f"\nDISCRIMINATOR (local): {'Yes.' if relevant else 'No.'}\n")
+    return relevant
+
+def is_relevant(query):
+    relevant = local_relevance(query)
+    if relevant is not None:
+        return relevant
+    discriminator_prompt = discriminator_template.format_messages(user_question=query)
+    is_relevant = service.discriminator.invoke(discriminator_prompt).content
+    print(f"\nDISCRIMINATOR: {is_relevant}\n")
+    return is_relevant == 'Yes.' # or results == [] meaning no passages are retrieved
 
-    irrelevant_prompt = PromptTemplate(
-        input_variables=["question"], 
-        template="A user has asked you: '{question}'. This is not something you are concerned with answering. Express to the user in your own words, briefly and succintly without elaboration, that you are not willing to discuss this topic."
-    )
+async def ais_relevant(query):
+    # the local classifier embeds the query, which would block the event loop
+    relevant = await asyncio.to_thread(local_relevance, query)
+    if relevant is not None:
+        return relevant
+    discriminator_prompt = discriminator_template.format_messages(user_question=query)
+    is_relevant = (await service.discriminator.ainvoke(discriminator_prompt)).content
+    print(f"\nDISCRIMINATOR: {is_relevant}\n")
+    return is_relevant == 'Yes.'
 
+def query_discriminator(query, restrictiveness):
     if restrictiveness == 2:
-        if not retriever.invoke(query):
+        if not service.retriever.invoke(query):
             print('NO HITS')
             return irrelevant_prompt.format(question=query)
         else:
             return query
-    
-    few_shot_human = ["how do you cook an egg?",
-                    "write me a program to calculate the area of a circle.",
-                    "How do you think the internet will change in the next 10 years?",
-                    "What did I just ask you?",
-                    ]
-    
-    few_shot_ai = ["No.",
-                "No.",
-                "Yes.",
-                "Yes."]
-
-    # setup llama instance for discriminator
-    discriminator = ChatOpenAI(base_url='http://10.249.72.3:8000/v1', api_key='gibberish')
-    discriminator_template = ChatPromptTemplate.from_messages(
-        [
-            ("system", "You exist to assess whether a user question is relevant to a professor of Computational Social Science taking questions from an audience. If the question is something the professor might be willing to discuss, respond with 'Yes'. Otherwise, respond with 'No.'"),
-            ("human", few_shot_human[0]),
-            ("ai", few_shot_ai[0]),
-            ("human", few_shot_human[1]),
-            ("ai", few_shot_ai[1]),
-            ("human", few_shot_human[2]),
-            ("ai", few_shot_ai[2]),
-            ("human", few_shot_human[3]),
-            ("ai", few_shot_ai[3]),
-            ("human", "{user_question}"),
-            ("system", "Would this reasonably be something a member of the audience might ask or say? Respond only with 'Yes.' or 'No.'")
-        ]
-    )
 
-    discriminator_prompt = discriminator_template.format_messages(user_question=query)
-    is_relevant = discriminator.invoke(discriminator_prompt).content
-    print(f"\nDISCRIMINATOR: {is_relevant}\n")
-    if (is_relevant != 'Yes.'): # or results == [] meaning no passages are retrieved
+    if not is_relevant(query):
         return irrelevant_prompt.format(question=query)
     else:
         return query
+
+# Speculative turn for restrictiveness 1: the discriminator, the history-aware retrieval and the answer run
+# concurrently instead of one after the other. The answer is buffered until the discriminator says Yes, then
+# printed and committed to the chat history; if it says No, the answer is discarded and the turn is answered
+# with the irrelevant prompt exactly as in the sequential mode.
+async def speculative_turn(query, config):
+    values = service.app.get_state(config).values
+    state = {"input": query, "chat_history": values.get("chat_history", []), "summary": values.get("summary", "")}
+    chunks = asyncio.Queue()
+    context = []
+
+    async def generate():
+        nonlocal context
+        try:
+            async for chunk in service.rag_chain.astream(prompt_state(state)):
+                if 'answer' in chunk:
+                    await chunks.put(chunk['answer'])
+                elif 'context' in chunk:
+                    context = chunk['context']
+        except Exception as e:
+            print('EXCEPTION', e)
+        finally:
+            await chunks.put(None)
+
+    generation = asyncio.create_task(generate())
+    try:
+        relevant = await ais_relevant(query)
+        print('Dirk: ', end="")
+        if not relevant:
+            generation.cancel()
+            # through the synchronous node, which prints the answer as in the sequential mode
+            return await asyncio.to_thread(service.app.invoke, {'input': irrelevant_prompt.format(question=query)}, config=config)
+
+        answer = ""
+        while (chunk := await chunks.get()) is not None:
+            print(chunk, end="", flush=True)
+            answer += chunk
+        print()
+        await generation
+    finally:
+        # a failed discriminator call (or an interrupted turn) must not leave the answer streaming unawaited
+        if not generation.done():
+            generation.cancel()
+            await asyncio.gather(generation, return_exceptions=True)
+    service.app.update_state(config, {
+        "input": query,
+        **await aturn_update(state, answer),
+        "context": context,
+        "answer": answer,
+    }, as_node="model")
+    return {"input": query, "context": context, "answer": answer}
         
 # allow the user to decide how restrictive the LLM will be in responding to questions
 def get_restrictiveness(max_restrictiveness):
@@ -257,6 +614,8 @@ def get_restrictiveness(max_restrictiveness):
             print("Invalid input. Please enter a valid integer.")
 
 def main():
+    # the embedder, the index and the app load in the background while the user answers the first prompt
+    service.warm_up()
     restrictiveness = get_restrictiveness(2)
     log_output = True # for session logging to txt
     if log_output:
@@ -273,7 +632,11 @@ def main():
         sys.stdin = logger
 
     print(f"Dirk: Hello! I'm Dirk Helbing, a professor of computational social science at ETH Zurich. What would you like to ask?")
-    config = {"configurable": {"thread_id": "abc123"}} # necessary for lang graph
+    config = {"configurable": {"thread_id": uuid.uuid4().hex}} # necessary for lang graph; a new session every run
+    # run the discriminator concurrently with retrieval and generation (restrictiveness 1 only; the semantic
+    # cache path is sequential); one event loop is kept for the session so the async clients can be reused
+    speculative = True
+    loop = asyncio.new_event_loop()
 
     # inspect chain if interested:
     # rag_chain.get_graph().print_ascii()
@@ -281,13 +644,34 @@ def main():
     try:
         while True: # q and a loop
             query = input('You: ')
-            if restrictiveness > 0:
-                query = query_discriminator(query, restrictiveness)
-            print('Dirk: ', end="")
-            result = app.invoke({'input':query}, config=config)
+            turn_started = time.perf_counter()
+            if speculative and restrictiveness == 1 and not use_semantic_cache:
+                result = loop.run_until_complete(speculative_turn(query, config))
+            else:
+                if restrictiveness > 0:
+                    query = query_discriminator(query, restrictiveness)
+                print('Dirk: ', end="")
+                result = service.app.invoke({'input':query}, config=config)
+            service.record("first query", time.perf_counter() - turn_started)
             papers = [doc.metadata['title'] for doc in result['context']]
             print(f'papers: {papers}')
     finally:
+        loop.close()
+        print(service.report())
+        print(service.embedding_cache.stats())
+        print(service.retrieval_cache.stats())
+        if service.loaded("chains"):
+            print(service.query_rewriter.stats())
+            if service.history_window is not None:
+                print(service.history_window.stats())
+        if service.loaded("semantic_cache") and service.semantic_cache is not None:
+            print(service.semantic_cache.stats())
+        if service.loaded("app") and checkpoint_path:
+            print(service.app.checkpointer.stats())
+        if service.loaded("clients"):
+            from llm_clients import registry
+            for line in registry.stats():
+                print(line)
         if log_output:
             # Restore original stdout and close log file
             sys.stdout = logger.stdout
@@ -296,5 +680,7 @@ def main():
 
     #     # print("\n\n\n\n",result)
 
+service.record("import", time.perf_counter() - import_started)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,240 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import socket
+import sys
+import time
+import uuid
+
+from aiohttp import web
+
+# the FAISS index, the embedder, the LLM clients and the LangGraph app are loaded once (chat.service) and shared by all sessions
+import chat_history as chat
+
+# Multi-session server in front of the LangGraph app of chat_history.py. Every client gets its own thread_id,
+# so sessions keep separate chat histories. Answers are streamed token by token:
+#   POST /chat  {"message": "...", "thread_id": "..."}   server-sent events, one JSON object per event
+#   GET  /ws?thread_id=...                                WebSocket, one JSON object per event; send questions as text
+#   GET  /health                                          sessions and turns in progress
+# Events are {"type": "session", "thread_id"}, {"type": "token", "text"} and
+# {"type": "done", "answer", "papers", "ttft", "latency"}, or {"type": "error", "message"}.
+# Run from the repository root: python main_chain/chat_server.py --port 8000 --restrictiveness 1 [--workers 4]
+
+class Busy(Exception):
+    pass
+
+class Session:
+    def __init__(self, thread_id, max_turns):
+        self.thread_id = thread_id
+        self.turns = asyncio.Semaphore(max_turns)
+        self.last_active = time.monotonic()
+
+class ChatServer:
+    """
+    Sessions by thread_id, with two limits: each session runs at most session_turns turns at a time
+    (further questions are refused until one finishes), and at most max_turns turns run at once overall.
+    Up to max_waiting turns wait for a free slot, for at most wait_timeout seconds; beyond that new turns
+    are refused, so a burst of clients cannot queue unbounded work. Sending to a slow client waits for its
+    connection to drain, which in turn holds back its turn.
+    """
+
+    def __init__(self, restrictiveness=0, max_turns=8, max_waiting=32, wait_timeout=30, session_turns=1,
+                 session_ttl=3600):
+        self.restrictiveness = restrictiveness
+        self.slots = asyncio.Semaphore(max_turns)
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.session_turns = session_turns
+        self.session_ttl = session_ttl
+        self.sessions = {}
+        self.waiting = 0
+        self.running = 0
+        self.refused = 0
+
+    def session(self, thread_id=None):
+        now = time.monotonic()
+        for idle in [key for key, session in self.sessions.items() if now - session.last_active > self.session_ttl]:
+            del self.sessions[idle]
+        thread_id = thread_id or uuid.uuid4().hex
+        if thread_id not in self.sessions:
+            self.sessions[thread_id] = Session(thread_id, self.session_turns)
+        session = self.sessions[thread_id]
+        session.last_active = now
+        return session
+
+    async def gate(self, query):
+        # the restrictiveness levels of chat_history.query_discriminator
+        if self.restrictiveness == 1 and not await chat.ais_relevant(query):
+            return chat.irrelevant_prompt.format(question=query)
+        if self.restrictiveness == 2:
+            return await asyncio.to_thread(chat.query_discriminator, query, 2)
+        return query
+
+    async def acquire(self, session):
+        if session.turns.locked():
+            raise Busy("A turn of this session is still in progress")
+        if self.waiting >= self.max_waiting:
+            raise Busy("Too many turns waiting, try again later")
+        await session.turns.acquire()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.wait_timeout)
+        except BaseException as e:
+            session.turns.release()
+            if isinstance(e, asyncio.TimeoutError):
+                raise Busy("Timed out waiting for a free slot, try again later") from None
+            raise
+        finally:
+            self.waiting -= 1
+
+    def release(self, session):
+        self.slots.release()
+        session.turns.release()
+
+    async def turn(self, session, query):
+        """
+        Answer one question of a session, yielding the events to send to the client.
+        """
+        start = time.perf_counter()
+        try:
+            await self.acquire(session)
+        except Busy as e:
+            self.refused += 1
+            yield {"type": "error", "message": str(e)}
+            return
+        self.running += 1
+        try:
+            config = {"configurable": {"thread_id": session.thread_id}}
+            ttft = None
+            result = {}
+            async for mode, payload in chat.service.app.astream({"input": await self.gate(query)}, config=config,
+                                                        stream_mode=["messages", "updates"]):
+                if mode == "messages":
+                    message, metadata = payload
+                    if metadata.get("chat_answer") and message.content:
+                        ttft = ttft if ttft is not None else time.perf_counter() - start
+                        yield {"type": "token", "text": message.content}
+                elif "model" in payload:
+                    result = payload["model"]
+            chat.service.record("first query", time.perf_counter() - start)
+            yield {
+                "type": "done",
+                "answer": result.get("answer", ""),
+                "papers": [doc.metadata.get('title') for doc in result.get("context", [])],
+                "ttft": ttft,
+                "latency": time.perf_counter() - start,
+            }
+        except Exception as e:
+            yield {"type": "error", "message": f"{type(e).__name__}: {e}"}
+        finally:
+            self.running -= 1
+            session.last_active = time.monotonic()
+            self.release(session)
+
+    async def chat_sse(self, request):
+        body = await request.json()
+        session = self.session(body.get("thread_id"))
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        await response.write(f"data: {json.dumps({'type': 'session', 'thread_id': session.thread_id})}\n\n".encode("utf-8"))
+        # closing the turn frees its slots right away if the client disconnects
+        async with contextlib.aclosing(self.turn(session, body["message"])) as events:
+            async for event in events:
+                # write() waits for the transport to drain, so a slow reader slows down its own turn only
+                await response.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+        await response.write_eof()
+        return response
+
+    async def chat_ws(self, request):
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        session = self.session(request.query.get("thread_id"))
+        await ws.send_json({"type": "session", "thread_id": session.thread_id})
+        async for message in ws:
+            if message.type != web.WSMsgType.TEXT:
+                break
+            async with contextlib.aclosing(self.turn(session, message.data)) as events:
+                async for event in events:
+                    await ws.send_json(event)
+        return ws
+
+    async def health(self, request):
+        # latency per LLM endpoint of this worker, see kb/llm_clients.py
+        from llm_clients import registry
+        return web.json_response({"sessions": len(self.sessions), "running": self.running,
+                                  "waiting": self.waiting, "refused": self.refused,
+                                  "llm_endpoints": registry.summary()})
+
+    async def report(self, application):
+        print(chat.service.report())
+        from llm_clients import registry
+        for line in registry.stats():
+            print(line)
+
+    def application(self):
+        application = web.Application()
+        application.on_shutdown.append(self.report)
+        application.router.add_post("/chat", self.chat_sse)
+        application.router.add_get("/ws", self.chat_ws)
+        application.router.add_get("/health", self.health)
+        return application
+
+def serve_forked(host, port, workers, make_server):
+    """
+    Pre-fork: load the embedder and the index once, then fork workers that accept connections on the same
+    socket. The workers share the parent's copy of the model weights and the index instead of loading their
+    own; each creates its LLM clients and app before it accepts connections. The chat histories are shared through the SQLite
+    checkpointer of chat_history.py, so any worker can answer the next turn of a session.
+    """
+    if not hasattr(os, "fork"):
+        sys.exit("--workers needs os.fork, which this platform does not have")
+    chat.service.preload()
+    sock = socket.create_server((host, port))
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                chat.service.warm_up()
+                chat.service.wait()
+                web.run_app(make_server().application(), sock=sock, print=None)
+            finally:
+                os._exit(0)
+        children.append(pid)
+    print(f"Serving on http://{host}:{port} with {workers} worker processes")
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        # Ctrl+C reaches the workers as well, which shut down on their own
+        for pid in children:
+            os.waitpid(pid, 0)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the digital twin to several clients at once.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--restrictiveness", type=int, default=0, choices=[0, 1, 2])
+    parser.add_argument("--max-turns", type=int, default=8, help="turns answered at the same time")
+    parser.add_argument("--max-waiting", type=int, default=32, help="turns waiting for a slot before new ones are refused")
+    parser.add_argument("--session-turns", type=int, default=1, help="turns at the same time per session")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes forked after loading the embedder and the index (limits apply per worker)")
+    args = parser.parse_args()
+
+    def make_server():
+        return ChatServer(args.restrictiveness, args.max_turns, args.max_waiting, session_turns=args.session_turns)
+
+    if args.workers > 1:
+        serve_forked(args.host, args.port, args.workers, make_server)
+    else:
+        # requests are only accepted once everything is loaded, as a component still loading would be
+        # waited for on the event loop and stall every other session
+        chat.service.warm_up()
+        chat.service.wait()
+        web.run_app(make_server().application(), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+import asyncio
+import random
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Sequence, Tuple
+
+import msgpack
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+)
+# the msgpack hooks of LangGraph's default serializer, for everything that is not a message or a document
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer, _msgpack_default, _msgpack_ext_hook
+from langgraph.checkpoint.serde.types import TASKS
+
+# Checkpointer for the LangGraph app of chat_history.py, in place of MemorySaver, which keeps every checkpoint
+# of every session in process memory until the process exits. Checkpoints are stored in SQLite, so sessions
+# survive a restart and are shared by the worker processes of chat_server.py; only the last few checkpoints
+# of each session are kept, and sessions idle for longer than max_idle are deleted.
+
+EXT_MESSAGE = 100
+EXT_DOCUMENT = 101
+message_types = {"human": HumanMessage, "ai": AIMessage}
+
+class CompactSerializer(JsonPlusSerializer):
+    """
+    msgpack like LangGraph's default serializer, except that the chat messages are stored as (type, content, id)
+    and the retrieved documents as (page_content, metadata) rather than with every field of their pydantic
+    models, and that blobs of at least min_compress bytes are zlib-compressed.
+    """
+
+    def __init__(self, min_compress=1024):
+        super().__init__()
+        self.min_compress = min_compress
+
+    @staticmethod
+    def default(obj):
+        if type(obj) in (HumanMessage, AIMessage):
+            return msgpack.ExtType(EXT_MESSAGE, msgpack.packb((obj.type, obj.content, obj.id)))
+        if type(obj) is Document:
+            return msgpack.ExtType(EXT_DOCUMENT, msgpack.packb((obj.page_content, obj.metadata),
+                                                               default=CompactSerializer.default))
+        return _msgpack_default(obj)
+
+    @staticmethod
+    def ext_hook(code, data):
+        if code == EXT_MESSAGE:
+            type_, content, id_ = msgpack.unpackb(data)
+            return message_types[type_](content=content, id=id_)
+        if code == EXT_DOCUMENT:
+            page_content, metadata = msgpack.unpackb(data, ext_hook=CompactSerializer.ext_hook, strict_map_key=False)
+            return Document(page_content=page_content, metadata=metadata)
+        return _msgpack_ext_hook(code, data)
+
+    def dumps_typed(self, obj):
+        if isinstance(obj, (bytes, bytearray)):
+            return super().dumps_typed(obj)
+        try:
+            data = msgpack.packb(obj, default=self.default)
+        except UnicodeEncodeError:
+            return super().dumps_typed(obj)
+        if len(data) >= self.min_compress:
+            return "compact+zlib", zlib.compress(data)
+        return "compact", data
+
+    def loads_typed(self, data):
+        type_, blob = data
+        if type_ == "compact+zlib":
+            type_, blob = "compact", zlib.decompress(blob)
+        if type_ == "compact":
+            return msgpack.unpackb(blob, ext_hook=self.ext_hook, strict_map_key=False)
+        return super().loads_typed(data)
+
+class SQLiteCheckpointer(BaseCheckpointSaver[str]):
+    """
+    LangGraph checkpointer backed by one SQLite file. After every checkpoint of a session only its newest `keep`
+    checkpoints (and their pending writes) are kept: the latest is all that get_state and the next turn read,
+    and its parent holds the writes the latest may still need. Sessions without a new checkpoint for max_idle
+    seconds are deleted, checked at most every evict_every seconds.
+    """
+
+    def __init__(self, path="main_chain/checkpoints.sqlite", keep=2, max_idle=24 * 3600, evict_every=60, serde=None):
+        """
+        Args:
+            path (str): SQLite file holding the checkpoints; created if it does not exist.
+            keep (int): Checkpoints kept per session (at least 1).
+            max_idle (float): Seconds after its last checkpoint that a session is deleted.
+            evict_every (float): Minimum seconds between two checks for idle sessions.
+            serde: Serializer of the checkpoints; CompactSerializer by default.
+        """
+        super().__init__(serde=serde or CompactSerializer())
+        self.path = path
+        self.keep = max(1, keep)
+        self.max_idle = max_idle
+        self.evict_every = evict_every
+        self.last_eviction = 0.0
+        self.pruned = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+        # one connection shared by the threads of this process (under the lock); other processes open their own
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            " thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL, parent_id TEXT,"
+            " type TEXT NOT NULL, checkpoint BLOB NOT NULL, metadata_type TEXT NOT NULL, metadata BLOB NOT NULL,"
+            " PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS writes ("
+            " thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL, task_id TEXT NOT NULL,"
+            " idx INTEGER NOT NULL, channel TEXT NOT NULL, type TEXT NOT NULL, value BLOB NOT NULL,"
+            " PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx))"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS threads (thread_id TEXT PRIMARY KEY, last_used REAL NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS threads_last_used ON threads (last_used)")
+        self.conn.commit()
+
+    def checkpoint_tuple(self, row):
+        # called under the lock
+        thread_id, checkpoint_ns, checkpoint_id, parent_id, type_, checkpoint, metadata_type, metadata = row
+        writes = self.conn.execute(
+            "SELECT task_id, channel, type, value FROM writes"
+            " WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+        sends = self.conn.execute(
+            "SELECT type, value FROM writes"
+            " WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? AND channel = ? ORDER BY task_id, idx",
+            (thread_id, checkpoint_ns, parent_id, TASKS),
+        ).fetchall() if parent_id else []
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                     "checkpoint_id": checkpoint_id}},
+            checkpoint={
+                **self.serde.loads_typed((type_, checkpoint)),
+                "pending_sends": [self.serde.loads_typed(send) for send in sends],
+            },
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                            "checkpoint_id": parent_id}} if parent_id else None,
+            pending_writes=[(task_id, channel, self.serde.loads_typed((value_type, value)))
+                            for task_id, channel, value_type, value in writes],
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        columns = "thread_id, checkpoint_ns, checkpoint_id, parent_id, type, checkpoint, metadata_type, metadata"
+        with self.lock:
+            if checkpoint_id := get_checkpoint_id(config):
+                row = self.conn.execute(
+                    f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id),
+                ).fetchone()
+            else:
+                row = self.conn.execute(
+                    f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?"
+                    " ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns),
+                ).fetchone()
+            return self.checkpoint_tuple(row) if row else None
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        conditions, params = [], []
+        if config:
+            conditions.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if config["configurable"].get("checkpoint_ns") is not None:
+                conditions.append("checkpoint_ns = ?")
+                params.append(config["configurable"]["checkpoint_ns"])
+            if checkpoint_id := get_checkpoint_id(config):
+                conditions.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            conditions.append("checkpoint_id < ?")
+            params.append(before_id)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_id, type, checkpoint, metadata_type, metadata"
+                f" FROM checkpoints{where} ORDER BY checkpoint_id DESC",
+                params,
+            ).fetchall()
+        for row in rows:
+            if limit is not None and limit <= 0:
+                break
+            if filter:
+                metadata = self.serde.loads_typed((row[6], row[7]))
+                if not all(metadata.get(key) == value for key, value in filter.items()):
+                    continue
+            with self.lock:
+                checkpoint_tuple = self.checkpoint_tuple(row)
+            if limit is not None:
+                limit -= 1
+            yield checkpoint_tuple
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        saved = checkpoint.copy()
+        saved.pop("pending_sends", None)
+        type_, blob = self.serde.dumps_typed(saved)
+        metadata_type, metadata_blob = self.serde.dumps_typed(metadata)
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+                 type_, blob, metadata_type, metadata_blob),
+            )
+            self.conn.execute("INSERT OR REPLACE INTO threads VALUES (?, ?)", (thread_id, now))
+            self.prune(thread_id, checkpoint_ns)
+            if now - self.last_eviction >= self.evict_every:
+                self.evict_idle(now)
+            self.conn.commit()
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                 "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+    ) -> None:
+        configurable = config["configurable"]
+        rows = [
+            (configurable["thread_id"], configurable["checkpoint_ns"], configurable["checkpoint_id"], task_id,
+             WRITES_IDX_MAP.get(channel, idx), channel, *self.serde.dumps_typed(value))
+            for idx, (channel, value) in enumerate(writes)
+        ]
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.conn.commit()
+
+    def prune(self, thread_id, checkpoint_ns):
+        # called under the lock; deletes all but the newest `keep` checkpoints of the session and their writes
+        kept = ("SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?"
+                " ORDER BY checkpoint_id DESC LIMIT ?")
+        params = (thread_id, checkpoint_ns, thread_id, checkpoint_ns, self.keep)
+        self.conn.execute(
+            f"DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN ({kept})", params)
+        pruned = self.conn.execute(
+            f"DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN ({kept})", params)
+        self.pruned += pruned.rowcount
+
+    def evict_idle(self, now=None):
+        """
+        Delete the sessions whose last checkpoint is older than max_idle seconds.
+        """
+        now = now or time.time()
+        idle = "SELECT thread_id FROM threads WHERE last_used < ?"
+        cutoff = (now - self.max_idle,)
+        self.conn.execute(f"DELETE FROM writes WHERE thread_id IN ({idle})", cutoff)
+        self.conn.execute(f"DELETE FROM checkpoints WHERE thread_id IN ({idle})", cutoff)
+        self.evicted += self.conn.execute("DELETE FROM threads WHERE last_used < ?", cutoff).rowcount
+        self.last_eviction = now
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        checkpoint_tuples = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for checkpoint_tuple in checkpoint_tuples:
+            yield checkpoint_tuple
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+    ) -> None:
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id)
+
+    def get_next_version(self, current: Optional[str], channel) -> str:
+        # same scheme as MemorySaver: a zero-padded counter, so versions sort as strings
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    def size(self):
+        """
+        Returns:
+            tuple: (sessions, checkpoints, bytes of serialized checkpoints and writes) currently stored.
+        """
+        with self.lock:
+            (sessions,) = self.conn.execute("SELECT COUNT(*) FROM threads").fetchone()
+            checkpoints, checkpoint_bytes = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(checkpoint) + LENGTH(metadata)), 0) FROM checkpoints").fetchone()
+            (write_bytes,) = self.conn.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM writes").fetchone()
+        return sessions, checkpoints, checkpoint_bytes + write_bytes
+
+    def stats(self):
+        sessions, checkpoints, stored = self.size()
+        return (f"Checkpointer: {sessions} sessions, {checkpoints} checkpoints ({stored / 1e6:.2f} MB) in {self.path}, "
+                f"{self.pruned} old checkpoints pruned, {self.evicted} idle sessions evicted")
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,158 @@
+import threading
+import time
+
+from langchain_core.messages import RemoveMessage, SystemMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+from query_cache import QueryCache
+
+# Bounded chat history for the prompts of chat_history.py. Both the history rewrite and the RAG prompt used to
+# get the whole conversation, so prompt tokens (and prefill time on both LLM endpoints) grew with every turn.
+# The last turns are kept verbatim within a token budget; older turns are folded into a running summary, which
+# is updated incrementally by llm2 after a turn has been answered and stored in the graph state with the history.
+
+summarize_prompt = ChatPromptTemplate.from_messages(
+    [
+        ("system", "You keep a running summary of a conversation between a user and a digital twin of Dirk Helbing, a professor of Computational Social Science. "
+                   "Extend the current summary with the new lines of the conversation. Keep the topics, names, papers, questions and positions that a later question might refer back to. "
+                   "Respond only with the updated summary, in at most {max_words} words."),
+        ("human", "Current summary:\n{summary}\n\nNew lines of the conversation:\n{lines}"),
+    ]
+)
+
+# tokens a chat template adds around every message (role header and end-of-turn markers)
+message_overhead = 4
+
+def default_token_counter():
+    """
+    tiktoken's cl100k_base, which counts close to the Llama 3 tokenizer, or about four characters per token
+    when the encoding cannot be loaded (tiktoken downloads it on first use).
+    """
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    except Exception:
+        print("tiktoken encoding not available, estimating four characters per token")
+        return lambda text: len(text) // 4 + 1
+
+class HistoryWindow:
+    """
+    Keeps at most keep_turns turns (a question and its answer) and at most budget tokens of the chat history
+    verbatim. When a new turn exceeds either, the oldest turns are folded into the summary, down to
+    keep_turns - fold_turns + 1 turns, so that the summary is only updated every fold_turns turns; the newest
+    turn is always kept. Token counts are cached per message text.
+    """
+
+    def __init__(self, llm, budget=1500, keep_turns=4, fold_turns=2, max_summary_words=150, count_tokens=None):
+        """
+        Args:
+            llm: Chat model that updates the summary (the weaker llm2 is enough).
+            budget (int): Maximum tokens of the verbatim turns.
+            keep_turns (int): Maximum number of verbatim turns.
+            fold_turns (int): Turns folded into the summary at a time.
+            max_summary_words (int): Length limit given to the summarizer.
+            count_tokens (callable): Returns the number of tokens of a text; default_token_counter() by default.
+        """
+        self.chain = summarize_prompt | llm | StrOutputParser()
+        self.budget = budget
+        self.keep_turns = keep_turns
+        self.fold_turns = fold_turns
+        self.max_summary_words = max_summary_words
+        self.count_tokens = count_tokens
+        self.token_counts = QueryCache("token count", max_entries=4096, ttl=24 * 3600)
+        self.lock = threading.Lock()
+        self.folds = 0
+        self.folded_turns = 0
+        self.summary_seconds = 0.0
+        self.turns = 0
+        self.window_tokens = 0
+
+    def tokens(self, message):
+        text = message.content if isinstance(message.content, str) else str(message.content)
+        count = self.token_counts.get(text)
+        if count is None:
+            with self.lock:
+                if self.count_tokens is None:
+                    self.count_tokens = default_token_counter()
+            count = self.count_tokens(text) + message_overhead
+            self.token_counts.put(text, count)
+        return count
+
+    def messages(self, state):
+        """
+        The chat history to put into the prompts: the summary of the folded turns, if any, then the recent turns.
+        """
+        history = list(state.get("chat_history") or [])
+        if state.get("summary"):
+            history.insert(0, SystemMessage(f"Summary of the earlier conversation: {state['summary']}"))
+        tokens = sum(self.tokens(message) for message in history)
+        with self.lock:
+            self.turns += 1
+            self.window_tokens += tokens
+        return history
+
+    def to_fold(self, history):
+        """
+        Returns:
+            int: Number of oldest messages of the history to fold into the summary (whole turns of two messages).
+        """
+        counts = [self.tokens(message) for message in history]
+        turns = len(history) // 2
+        if turns <= self.keep_turns and sum(counts) <= self.budget:
+            return 0
+        folded = 0
+        while turns > 1 and (turns > self.keep_turns - self.fold_turns + 1 or sum(counts[folded:]) > self.budget):
+            folded += 2
+            turns -= 1
+        return folded
+
+    def update(self, folded, new_messages, summary):
+        with self.lock:
+            self.folds += 1
+            self.folded_turns += len(folded) // 2
+        return {"chat_history": [RemoveMessage(id=message.id) for message in folded] + new_messages, "summary": summary}
+
+    def summary_inputs(self, state, folded):
+        lines = "\n".join(f"{'User' if message.type == 'human' else 'Dirk'}: {message.content}" for message in folded)
+        return {"summary": state.get("summary") or "(none yet)", "lines": lines, "max_words": self.max_summary_words}
+
+    def fold(self, state, new_messages):
+        """
+        Returns:
+            dict: The state update that adds the new turn's messages to the history and, if the window is
+                exceeded, removes the oldest turns from it and stores the updated summary.
+        """
+        history = list(state.get("chat_history") or []) + new_messages
+        folded = history[:self.to_fold(history)]
+        if not folded:
+            return {"chat_history": new_messages}
+        start = time.perf_counter()
+        try:
+            summary = self.chain.invoke(self.summary_inputs(state, folded))
+        except Exception as e:
+            # keep the turns verbatim and try again after the next turn
+            print('EXCEPTION', e)
+            return {"chat_history": new_messages}
+        self.summary_seconds += time.perf_counter() - start
+        return self.update(folded, new_messages, summary)
+
+    async def afold(self, state, new_messages):
+        history = list(state.get("chat_history") or []) + new_messages
+        folded = history[:self.to_fold(history)]
+        if not folded:
+            return {"chat_history": new_messages}
+        start = time.perf_counter()
+        try:
+            summary = await self.chain.ainvoke(self.summary_inputs(state, folded))
+        except Exception as e:
+            print('EXCEPTION', e)
+            return {"chat_history": new_messages}
+        self.summary_seconds += time.perf_counter() - start
+        return self.update(folded, new_messages, summary)
+
+    def stats(self):
+        average = self.window_tokens / self.turns if self.turns else 0.0
+        return (f"History window: {average:.0f} history tokens per prompt on average, {self.folds} summary updates "
+                f"({self.folded_turns} turns folded, {self.summary_seconds:.1f} s), {self.token_counts.stats()}")
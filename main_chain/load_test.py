@@ -0,0 +1,74 @@
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+import numpy as np
+
+# Load test for chat_server.py: N concurrent sessions each ask a few questions one after the other over
+# server-sent events, and the time to first token and the total latency of every turn are reported.
+#   python main_chain/load_test.py --url http://localhost:8000 --sessions 1 4 16 --turns 3
+
+questions = [
+    "What does digital democracy mean?",
+    "How can cities become smarter without becoming surveillance states?",
+    "What are the risks of nudging?",
+    "What is your view on participatory budgeting?",
+    "How should societies govern artificial intelligence?",
+]
+
+async def ask(http, url, message, thread_id):
+    """
+    Returns:
+        tuple: (thread_id, seconds to the first token or None, total seconds, error message or None)
+    """
+    start = time.perf_counter()
+    ttft = None
+    async with http.post(f"{url}/chat", json={"message": message, "thread_id": thread_id}) as response:
+        async for line in response.content:
+            if not line.startswith(b"data: "):
+                continue
+            event = json.loads(line[len(b"data: "):])
+            if event["type"] == "session":
+                thread_id = event["thread_id"]
+            elif event["type"] == "token" and ttft is None:
+                ttft = time.perf_counter() - start
+            elif event["type"] == "error":
+                return thread_id, ttft, time.perf_counter() - start, event["message"]
+    return thread_id, ttft, time.perf_counter() - start, None
+
+async def session(http, url, turns, offset, results):
+    thread_id = None
+    for turn in range(turns):
+        thread_id, ttft, latency, error = await ask(http, url, questions[(offset + turn) % len(questions)], thread_id)
+        results.append((ttft, latency, error))
+
+async def run(url, n_sessions, turns):
+    results = []
+    start = time.perf_counter()
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None)) as http:
+        await asyncio.gather(*(session(http, url, turns, i, results) for i in range(n_sessions)))
+    elapsed = time.perf_counter() - start
+
+    errors = [error for _, _, error in results if error]
+    ttfts = np.array([ttft for ttft, _, error in results if not error and ttft is not None])
+    latencies = np.array([latency for _, latency, error in results if not error])
+    line = f"{n_sessions:4d} sessions: {len(results) / elapsed:6.2f} turns/s, {len(errors)} errors"
+    if len(latencies):
+        line += (f"  latency p50 {np.percentile(latencies, 50):6.2f} s p99 {np.percentile(latencies, 99):6.2f} s")
+    if len(ttfts):
+        line += (f"  first token p50 {np.percentile(ttfts, 50):6.2f} s p99 {np.percentile(ttfts, 99):6.2f} s")
+    print(line)
+    for error in sorted(set(errors)):
+        print(f"      {errors.count(error)} x {error}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent sessions against chat_server.py.")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 4, 16], help="numbers of concurrent sessions")
+    parser.add_argument("--turns", type=int, default=3, help="questions per session")
+    args = parser.parse_args()
+
+    for n_sessions in args.sessions:
+        asyncio.run(run(args.url, n_sessions, args.turns))
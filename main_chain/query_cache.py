@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+# Caches in front of the query embedding and the FAISS retriever of the chat loop. Within a turn the same
+# query is embedded and searched by the discriminator and again by the history-aware retriever, and
+# audiences repeat questions across turns.
+
+def normalize_query(text):
+    # BGE's tokenizer lowercases and splits on whitespace, so these variants embed identically
+    return " ".join(text.lower().split())
+
+def index_version(index_path):
+    """
+    Identify the index currently published at index_path: vector_store.py saves every build to a new
+    versioned directory and repoints the index_path symlink at it, so the resolved path changes with
+    every rebuild. The mtime of the index file covers indexes saved in place.
+    """
+    index_dir = os.path.realpath(index_path)
+    return f"{index_dir}:{os.stat(os.path.join(index_dir, 'index.faiss')).st_mtime_ns}"
+
+class QueryCache:
+    """
+    Thread-safe LRU cache whose entries also expire ttl seconds after they were stored.
+    """
+
+    def __init__(self, name, max_entries=1024, ttl=600):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.invalidations += 1
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return (f"{self.name} cache: {self.hits} hits, {self.misses} misses ({self.hit_rate:.1%} hit rate), "
+                f"{self.evictions} evicted, {self.invalidations} invalidations, {len(self.entries)} entries")
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Wraps a LangChain embedding model so that embed_query is computed once per normalized query text.
+    Documents are passed straight through.
+    """
+
+    def __init__(self, embeddings, cache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = normalize_query(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.put(key, vector)
+        return vector
+
+class CachedRetriever(BaseRetriever):
+    """
+    Caches the documents retrieved per (normalized query, index version). When the published index changes,
+    the cache is cleared and, if reload is given, the wrapped retriever is replaced by reload().
+    """
+
+    retriever: BaseRetriever
+    cache: Any
+    version: Callable[[], str]
+    reload: Optional[Callable[[], BaseRetriever]] = None
+    current_version: Optional[str] = None
+
+    def check_version(self):
+        version = self.version()
+        if version != self.current_version:
+            if self.current_version is not None:
+                print(f"Index changed to {version}, clearing the {self.cache.name} cache")
+                if self.reload is not None:
+                    self.retriever = self.reload()
+                self.cache.clear()
+            self.current_version = version
+        return version
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        key = (normalize_query(query), self.check_version())
+        docs = self.cache.get(key)
+        if docs is None:
+            docs = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+            self.cache.put(key, docs)
+        return list(docs)
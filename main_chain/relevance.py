@@ -0,0 +1,149 @@
+import glob
+import os
+import re
+
+import numpy as np
+from langchain_core.prompts import ChatPromptTemplate
+
+# Relevance discriminator for restrictiveness 1: the few-shot LLM prompt, and a local classifier over the
+# BGE query embedding that answers most questions without the LLM round trip. The classifier is trained
+# from the discriminator's answers in the logged chat sessions plus the few-shot examples:
+#   python main_chain/relevance.py            (writes main_chain/relevance_classifier.npz)
+
+few_shot_human = ["how do you cook an egg?",
+                "write me a program to calculate the area of a circle.",
+                "How do you think the internet will change in the next 10 years?",
+                "What did I just ask you?",
+                ]
+
+few_shot_ai = ["No.",
+            "No.",
+            "Yes.",
+            "Yes."]
+
+discriminator_template = ChatPromptTemplate.from_messages(
+    [
+        ("system", "You exist to assess whether a user question is relevant to a professor of Computational Social Science taking questions from an audience. If the question is something the professor might be willing to discuss, respond with 'Yes'. Otherwise, respond with 'No.'"),
+        ("human", few_shot_human[0]),
+        ("ai", few_shot_ai[0]),
+        ("human", few_shot_human[1]),
+        ("ai", few_shot_ai[1]),
+        ("human", few_shot_human[2]),
+        ("ai", few_shot_ai[2]),
+        ("human", few_shot_human[3]),
+        ("ai", few_shot_ai[3]),
+        ("human", "{user_question}"),
+        ("system", "Would this reasonably be something a member of the audience might ask or say? Respond only with 'Yes.' or 'No.'")
+    ]
+)
+
+log_pattern = "main_chain/chat_logs_*/digital_dirk_output_*.txt"
+classifier_path = "main_chain/relevance_classifier.npz"
+
+def parse_log(path):
+    """
+    Read the (question, relevant) pairs of a logged session: every user question followed by an answer of the
+    LLM discriminator ("DISCRIMINATOR: Yes."). Questions without one, e.g. from sessions without the
+    discriminator, are skipped, and so are the local classifier's own answers ("DISCRIMINATOR (local): ...").
+    """
+    examples = []
+    question = None
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            # the console logger records the input prompt and the input line, so questions read "You: You: ..."
+            asked = re.match(r"(?:You: )+(.*)", line)
+            if asked:
+                question = asked.group(1).strip() or None
+                continue
+            answer = re.match(r"DISCRIMINATOR: (.*)", line)
+            if answer and question:
+                examples.append((question, answer.group(1).strip() == "Yes."))
+                question = None
+    return examples
+
+def load_examples(pattern=log_pattern):
+    """
+    Returns:
+        tuple: (questions, labels) from the logged sessions and the few-shot examples, one per distinct question.
+    """
+    examples = {}
+    for path in sorted(glob.glob(pattern)):
+        for question, relevant in parse_log(path):
+            examples[question.lower()] = (question, relevant)
+    for question, answer in zip(few_shot_human, few_shot_ai):
+        examples[question.lower()] = (question, answer == "Yes.")
+    questions = [question for question, _ in examples.values()]
+    labels = [relevant for _, relevant in examples.values()]
+    return questions, labels
+
+class RelevanceClassifier:
+    """
+    Logistic regression over unit-length query embeddings. predict() only answers when the probability of
+    its answer is at least `confidence`, and returns None otherwise so the caller can fall back to the LLM.
+    """
+
+    def __init__(self, embeddings, coef=None, intercept=0.0, confidence=0.9):
+        self.embeddings = embeddings
+        self.coef = coef
+        self.intercept = intercept
+        self.confidence = confidence
+
+    def embed(self, questions):
+        # embedded as queries, like the questions of the chat loop, whose query embedding is cached for retrieval
+        vectors = np.asarray([self.embeddings.embed_query(question) for question in questions], dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def fit(self, questions, labels, vectors=None):
+        from sklearn.linear_model import LogisticRegression
+
+        if len(set(labels)) < 2:
+            raise ValueError("Training the relevance classifier needs both relevant and irrelevant examples")
+        vectors = self.embed(questions) if vectors is None else vectors
+        model = LogisticRegression(C=10.0, class_weight="balanced", max_iter=1000).fit(vectors, labels)
+        self.coef = model.coef_[0].astype(np.float32)
+        self.intercept = float(model.intercept_[0])
+        return self
+
+    def probabilities(self, vectors):
+        return 1 / (1 + np.exp(-(vectors @ self.coef + self.intercept)))
+
+    def probability(self, question):
+        vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        return float(self.probabilities(vector / np.linalg.norm(vector)))
+
+    def predict(self, question):
+        """
+        Returns:
+            bool: Whether the question is relevant, or None if the classifier is not confident either way.
+        """
+        probability = self.probability(question)
+        if probability >= self.confidence:
+            return True
+        if probability <= 1 - self.confidence:
+            return False
+        return None
+
+    def save(self, path=classifier_path):
+        np.savez(path, coef=self.coef, intercept=self.intercept)
+
+    @classmethod
+    def load(cls, embeddings, path=classifier_path, confidence=0.9):
+        """
+        Returns:
+            RelevanceClassifier: The saved classifier, or None if it has not been trained yet.
+        """
+        if not os.path.exists(path):
+            return None
+        saved = np.load(path)
+        return cls(embeddings, saved["coef"], float(saved["intercept"]), confidence)
+
+if __name__ == "__main__":
+    import sys
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "kb"))
+    from embedding_backend import make_embeddings
+
+    questions, labels = load_examples()
+    print(f"{len(questions)} labelled questions ({sum(labels)} relevant) from {log_pattern} and the few-shot examples")
+    classifier = RelevanceClassifier(make_embeddings()).fit(questions, labels)
+    classifier.save()
+    print(f"Relevance classifier saved to {classifier_path}")
@@ -0,0 +1,124 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+class SemanticCache:
+    """
+    Answers to earlier standalone questions, looked up by embedding similarity so that near-identical
+    questions ("what is digital democracy?", "What's digital democracy") reuse the stored answer and context
+    instead of another round trip to the LLMs.
+
+    Entries expire ttl seconds after they were stored; beyond max_entries the least recently used ones are
+    evicted. The cache is persisted in path as vectors.npy (unit-length query vectors, one row per entry)
+    and entries.json (question, answer, context and timestamps of each entry), and reloaded on start.
+    """
+
+    def __init__(self, embeddings, path="main_chain/semantic_cache", threshold=0.95, max_entries=512,
+                 ttl=24 * 3600, version=None):
+        """
+        Args:
+            embeddings: LangChain embedder used for the questions.
+            path (str): Directory the cache is persisted in.
+            threshold (float): Minimum cosine similarity between two questions for the stored answer to be reused.
+            max_entries (int): Maximum number of stored answers.
+            ttl (float): Seconds an answer stays valid.
+            version (callable): Returns the version of the knowledge base; answers given with another
+                version are not reused.
+        """
+        self.embeddings = embeddings
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version = version
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.vectors = None
+        self.entries = []
+        self.load()
+
+    def load(self):
+        try:
+            vectors = np.load(os.path.join(self.path, "vectors.npy"))
+            with open(os.path.join(self.path, "entries.json"), encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        if len(entries) == len(vectors):
+            self.vectors, self.entries = vectors, entries
+            self.expire()
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        for name, write in [("vectors.npy", lambda f: np.save(f, self.vectors)),
+                            ("entries.json", lambda f: f.write(json.dumps(self.entries).encode("utf-8")))]:
+            tmp_path = os.path.join(self.path, f"{name}.tmp")
+            with open(tmp_path, "wb") as f:
+                write(f)
+            os.replace(tmp_path, os.path.join(self.path, name))
+
+    def keep(self, rows):
+        self.vectors = self.vectors[rows] if rows else None
+        self.entries = [self.entries[row] for row in rows]
+
+    def expire(self):
+        now = time.time()
+        rows = [row for row, entry in enumerate(self.entries) if now - entry["created"] <= self.ttl]
+        if len(rows) < len(self.entries):
+            self.keep(rows)
+
+    def embed(self, question):
+        vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def lookup(self, question):
+        """
+        Returns:
+            dict: The answer and context documents stored for the most similar question, with that question
+            and its similarity, or None if no stored question is similar enough.
+        """
+        vector = self.embed(question)
+        version = self.version() if self.version else None
+        with self.lock:
+            self.expire()
+            if self.vectors is not None:
+                similarities = self.vectors @ vector
+                for row in np.argsort(-similarities):
+                    if similarities[row] < self.threshold:
+                        break
+                    entry = self.entries[row]
+                    if entry["version"] == version:
+                        entry["last_used"] = time.time()
+                        self.hits += 1
+                        return {"question": entry["question"], "similarity": float(similarities[row]),
+                                "answer": entry["answer"],
+                                "context": [Document(page_content=doc["page_content"], metadata=doc["metadata"])
+                                            for doc in entry["context"]]}
+            self.misses += 1
+            return None
+
+    def store(self, question, answer, context):
+        vector = self.embed(question)
+        now = time.time()
+        entry = {"question": question, "answer": answer, "created": now, "last_used": now,
+                 "version": self.version() if self.version else None,
+                 "context": [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in context]}
+        with self.lock:
+            self.vectors = vector[None] if self.vectors is None else np.vstack([self.vectors, vector])
+            self.entries.append(entry)
+            self.expire()
+            if len(self.entries) > self.max_entries:
+                recent = sorted(range(len(self.entries)), key=lambda row: self.entries[row]["last_used"])
+                self.keep(sorted(recent[-self.max_entries:]))
+            self.save()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return (f"Semantic cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1%} hit rate), "
+                f"{len(self.entries)} entries in {self.path}")
@@ -1,16 +1,22 @@
 # Simple chain using gpt 4o
 
+import os
+import sys
+
 from langchain_core.prompts import (
     PromptTemplate,
     ChatPromptTemplate
 )
-from langchain_openai import ChatOpenAI
 from langchain_openai import OpenAIEmbeddings
 
 from langchain_community.vectorstores import FAISS
 
+# pooled LLM clients shared with the other chains (kb/llm_clients.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "kb"))
+from llm_clients import chat_model
+
 # Initialize the OpenAI LLM
-llm = ChatOpenAI(model_name="gpt-4o", temperature=0.7)
+llm = chat_model(model_name="gpt-4o", temperature=0.7)
 
 # Create a PromptTemplate to format the politician's stance on a specific topic
 template = """
@@ -42,7 +48,7 @@ user_question = input("You: ")
 while user_question != "exit":
     results = retriever.invoke(user_question)
     # validate the user question
-    discriminator = ChatOpenAI(model_name="gpt-4o-mini", temperature=0.7)
+    discriminator = chat_model(model_name="gpt-4o-mini", temperature=0.7) # the same client every turn
     chat_template = ChatPromptTemplate.from_messages(
         [
             ("system", "You exist to assess whether a user question is relevant to a professor taking questions from an audience. If the question is something the professor would be willing to discuss, respond with 'Yes'. Otherwise, respond with 'No'."),
@@ -4,29 +4,24 @@ from langchain_core.prompts import (
     PromptTemplate,
     ChatPromptTemplate
 )
-from langchain_openai import ChatOpenAI
 #import query_kb
 
 from langchain_community.vectorstores import FAISS
 
-# open source embeddings
-from langchain_community.embeddings import HuggingFaceBgeEmbeddings
+# open source embeddings, created by the shared factory in kb/ (device, threads and backend are configurable)
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "kb"))
+from embedding_backend import make_embeddings
+from llm_clients import chat_model
 
-model_name = "BAAI/bge-base-en-v1.5"
-model_kwargs = {"device": "cpu"}
-encode_kwargs = {"normalize_embeddings": False}
-
-hf = HuggingFaceBgeEmbeddings(
-    model_name=model_name,
-    model_kwargs=model_kwargs,
-    encode_kwargs=encode_kwargs
-)
+hf = make_embeddings()
 
 # print prompts or not:
 print_prompts = True
 
 # setup llama instance for digital twin
-llm = ChatOpenAI(base_url='http://10.249.72.3:8000/v1', api_key='gibberish')
+llm = chat_model('http://10.249.72.3:8000/v1', api_key='gibberish')
 
 # make the prompt templates
 system_prompt = """
@@ -90,7 +85,7 @@ RAG_prompt = ChatPromptTemplate([
 
 # setup llama instance for discriminator
 
-# discriminator = ChatOpenAI(base_url='http://10.249.72.3:8000/v1', api_key='gibberish')
+# discriminator = chat_model('http://10.249.72.3:8000/v1', api_key='gibberish')
 # discriminator_template = ChatPromptTemplate.from_messages(
 #     [
 #         ("system", "You exist to assess whether a user question is relevant to a professor taking questions from an audience. If the question is something the professor might be willing to discuss, respond with 'Yes'. Otherwise, respond with 'No.'"),
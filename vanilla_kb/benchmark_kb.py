@@ -0,0 +1,118 @@
+import time
+import numpy as np
+from vanilla_kb.knowledge_base import KnowledgeBase
+
+# Compare the matrix-backed KnowledgeBase against the original per-item Python loop,
+# then the approximate 'ivf' index against the exact scan (recall@k vs latency),
+# then the compressed storage modes (memory per vector vs recall@k).
+# Run from the repository root: python -m vanilla_kb.benchmark_kb
+
+dim = 768
+sizes = [1_000, 10_000, 50_000]
+n_queries = 20
+k = 5
+
+def loop_retrieve(store, key, metric, k):
+    # the original KnowledgeBase.retrieve: score item by item, then sort everything
+    similarities = []
+    for item_key, val in store:
+        a, b = np.array(key), np.array(item_key)
+        if metric == 'l2':
+            similarities.append((np.linalg.norm(a - b), val))
+        elif metric == 'cos':
+            similarities.append((np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)), val))
+        elif metric == 'ip':
+            similarities.append((np.dot(a, b), val))
+    similarities.sort(reverse=metric in ['cos', 'ip'], key=lambda x: x[0])
+    return [val for _, val in similarities[:k]]
+
+def time_per_query(fn, queries):
+    start = time.perf_counter()
+    for query in queries:
+        fn(query)
+    return (time.perf_counter() - start) / len(queries) * 1000
+
+def clustered_vectors(rng, n, n_clusters=200):
+    # embeddings of real passages are clustered by topic; uniform noise would make any IVF look bad
+    centers = rng.standard_normal((n_clusters, dim)) * 0.5
+    return (centers[rng.integers(0, n_clusters, n)] + rng.standard_normal((n, dim))).astype(np.float32)
+
+def benchmark_loop(rng):
+    for n in sizes:
+        vectors = rng.standard_normal((n, dim)).astype(np.float32)
+        queries = rng.standard_normal((n_queries, dim)).astype(np.float32)
+
+        kb = KnowledgeBase(dim=dim)
+        for i, vector in enumerate(vectors):
+            kb.add_item(vector, i)
+        store = [(vector, i) for i, vector in enumerate(vectors)]
+
+        for metric in ['l2', 'cos', 'ip']:
+            # results should agree with the loop before we compare speed
+            for query in queries[:3]:
+                assert kb.retrieve(query, metric, k) == loop_retrieve(store, query, metric, k)
+            loop_ms = time_per_query(lambda q: loop_retrieve(store, q, metric, k), queries[:5])
+            matrix_ms = time_per_query(lambda q: kb.retrieve(q, metric, k), queries)
+            print(f"n={n:>6} metric={metric:<3} loop: {loop_ms:9.2f} ms/query  "
+                  f"matrix: {matrix_ms:7.3f} ms/query  speedup: {loop_ms / matrix_ms:7.1f}x")
+
+def benchmark_ivf(rng, n=200_000, nlist=256, nprobes=(1, 4, 8, 16, 32), metric='cos'):
+    vectors = clustered_vectors(rng, n + n_queries)
+    vectors, queries = vectors[:n], vectors[n:]
+
+    exact = KnowledgeBase(dim=dim, capacity=n)
+    exact.add_items(vectors, list(range(n)))
+    approx = KnowledgeBase(dim=dim, capacity=n, index='ivf', nlist=nlist)
+    approx.add_items(vectors, list(range(n)))
+    start = time.perf_counter()
+    approx.train()
+    print(f"ivf: trained {nlist} lists on n={n} in {time.perf_counter() - start:.1f} s")
+
+    truth = [set(exact.retrieve(q, metric, k)) for q in queries]
+    exact_ms = time_per_query(lambda q: exact.retrieve(q, metric, k), queries)
+    print(f"exact         recall@{k}: 1.000  {exact_ms:7.3f} ms/query")
+    for nprobe in nprobes:
+        approx.ivf.nprobe = nprobe
+        found = [set(approx.retrieve(q, metric, k)) for q in queries]
+        recall = np.mean([len(f & t) / k for f, t in zip(found, truth)])
+        ivf_ms = time_per_query(lambda q: approx.retrieve(q, metric, k), queries)
+        print(f"ivf nprobe={nprobe:<3} recall@{k}: {recall:.3f}  {ivf_ms:7.3f} ms/query  "
+              f"speedup: {exact_ms / ivf_ms:5.1f}x")
+
+def benchmark_storage(rng, n=50_000, metric='cos'):
+    vectors = clustered_vectors(rng, n + n_queries)
+    vectors, queries = vectors[:n], vectors[n:]
+    exact = KnowledgeBase(dim=dim, capacity=n)
+    exact.add_items(vectors, list(range(n)))
+    truth = [set(exact.retrieve(q, metric, k)) for q in queries]
+
+    configs = [
+        dict(storage='float32'),
+        dict(storage='float16', rerank=0),
+        dict(storage='float16'),
+        dict(storage='pq', pq_m=96, rerank=0),
+        dict(storage='pq', pq_m=96, rerank=4),
+        dict(storage='pq', pq_m=96, rerank=16),
+        dict(storage='pq', pq_m=48, rerank=16),
+        dict(storage='pq', pq_m=192, rerank=4),
+    ]
+    for config in configs:
+        kb = KnowledgeBase(dim=dim, capacity=n, **config)
+        kb.add_items(vectors, list(range(n)))
+        if config['storage'] == 'pq':
+            kb.train()
+        # bytes per vector that a query scans and that must stay resident; the float32 keys of the
+        # compressed modes are only read for re-ranked rows and can stay on disk (load(mmap=True))
+        resident = kb._norms[:n].nbytes + (kb._compressed[:n] if kb._compressed is not None else kb.keys).nbytes
+        found = [set(kb.retrieve(q, metric, k)) for q in queries]
+        recall = np.mean([len(f & t) / k for f, t in zip(found, truth)])
+        ms = time_per_query(lambda q: kb.retrieve(q, metric, k), queries)
+        name = ", ".join(f"{key}={value}" for key, value in config.items())
+        print(f"{name:<38} {resident / n:7.1f} B/vector ({n * dim * 4 / resident:5.1f}x smaller)  "
+              f"recall@{k}: {recall:.3f}  {ms:7.3f} ms/query")
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    benchmark_loop(rng)
+    benchmark_ivf(rng)
+    benchmark_storage(rng)
@@ -1,22 +1,29 @@
-from sentence_transformers import SentenceTransformer
+import argparse
+from vanilla_kb.embedding import load_model
 from vanilla_kb.knowledge_base import KnowledgeBase
-import tqdm
-import pickle
 import vanilla_kb.passages as passages
 
-kb = [passage["content"] for passage in passages.passages]
+def build(device=None, batch_size=32):
+    kb = [passage["content"] for passage in passages.passages]
 
-# Dense retrieval using Sentence Transformers
-model_embd = SentenceTransformer("bert-base-nli-mean-tokens").to("cuda:0")
-kb_index_embd = KnowledgeBase(dim=768)
+    # Dense retrieval using Sentence Transformers
+    model_embd = load_model(device)
+    kb_index_embd = KnowledgeBase(dim=768, capacity=len(kb))
 
-# Add each passage to the knowledge base
-for passage_index, passage_embd in enumerate(tqdm.tqdm(kb)):
-    kb_index_embd.add_item(model_embd.encode(passage_embd).squeeze(), passage_index)
+    # Encode all passages in batches and add them to the knowledge base in one block
+    passage_embd = model_embd.encode(kb, batch_size=batch_size, show_progress_bar=True)
+    kb_index_embd.add_items(passage_embd, list(range(len(kb))))
+    return kb_index_embd
 
-# Save the knowledge base index to disk
-with open("vanilla_kb/kb_index_embd.pkl", "wb") as f:
-    pickle.dump(kb_index_embd, f)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embed the passages and save the vanilla knowledge base.")
+    parser.add_argument("--device", default=None, help="e.g. cpu or cuda:0 (default: cuda:0 if available, else cpu)")
+    parser.add_argument("--batch-size", type=int, default=32, help="number of passages per encode batch")
+    args = parser.parse_args()
 
-print("Knowledge base index saved to disk.")
+    kb_index_embd = build(device=args.device, batch_size=args.batch_size)
 
+    # Save the knowledge base index to disk
+    kb_index_embd.save("vanilla_kb/kb_index_embd")
+
+    print("Knowledge base index saved to disk.")
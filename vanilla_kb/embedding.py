@@ -0,0 +1,17 @@
+from sentence_transformers import SentenceTransformer
+
+# the model used to embed both the passages and the questions
+model_name = "bert-base-nli-mean-tokens"
+
+def default_device():
+    """
+    Use the first GPU when there is one, otherwise fall back to the CPU.
+    """
+    import torch
+    return "cuda:0" if torch.cuda.is_available() else "cpu"
+
+def load_model(device=None):
+    """
+    Load the sentence transformer on the given device, or on default_device() if none is given.
+    """
+    return SentenceTransformer(model_name, device=device or default_device())
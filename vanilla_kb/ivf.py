@@ -0,0 +1,129 @@
+from typing import List
+import numpy as np
+
+def _sq_dists(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """
+    Squared Euclidean distances between every row of data and every centroid.
+    :param data: matrix of shape (n, dim)
+    :param centroids: matrix of shape (c, dim)
+    :return: Matrix of shape (n, c).
+    """
+    dots = data @ centroids.T
+    return (data * data).sum(axis=1, keepdims=True) - 2 * dots + (centroids * centroids).sum(axis=1)
+
+def nearest_centroid(data: np.ndarray, centroids: np.ndarray, block_size: int = 4096) -> np.ndarray:
+    """
+    Index of the closest centroid (L2) for every row of data, computed in blocks.
+    :param data: matrix of shape (n, dim)
+    :param centroids: matrix of shape (c, dim)
+    :param block_size: number of rows per distance matrix
+    :return: Array of n centroid indices.
+    """
+    assign = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), block_size):
+        assign[start:start + block_size] = _sq_dists(data[start:start + block_size], centroids).argmin(axis=1)
+    return assign
+
+def kmeans(data: np.ndarray, n_clusters: int, n_iter: int = 20, seed: int = 0) -> np.ndarray:
+    """
+    Plain Lloyd's k-means with centroids initialised from random rows.
+    :param data: float32 matrix of shape (n, dim), n >= n_clusters
+    :param n_clusters: number of centroids
+    :param n_iter: number of assignment/update rounds
+    :param seed: seed for initialisation and for re-seeding empty clusters
+    :return: float32 centroid matrix of shape (n_clusters, dim).
+    """
+    if len(data) < n_clusters:
+        raise ValueError(f"need at least {n_clusters} vectors to train {n_clusters} clusters, got {len(data)}")
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].astype(np.float32)
+    for _ in range(n_iter):
+        assign = nearest_centroid(data, centroids)
+        counts = np.bincount(assign, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # an empty cluster gets a random point so that every list stays in use
+        centroids[empty] = data[rng.choice(len(data), empty.sum(), replace=False)]
+    return centroids
+
+class IVFIndex:
+    def __init__(self, nlist: int = 64, nprobe: int = 8, seed: int = 0):
+        """
+        Inverted file index: vectors are bucketed by their nearest k-means centroid and
+        a query only scans the nprobe buckets whose centroids score best against it.
+        :param nlist: number of coarse centroids (buckets)
+        :param nprobe: number of buckets scanned per query
+        :param seed: seed for k-means
+        """
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.seed = seed
+        self.centroids = None
+        self.lists: List[List[int]] = [[] for _ in range(nlist)]
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def min_train_size(self) -> int:
+        """
+        Number of vectors to collect before training automatically (about 39 per centroid, as FAISS suggests).
+        """
+        return 39 * self.nlist
+
+    def train(self, keys: np.ndarray, max_train_size: int = 256):
+        """
+        Fit the coarse centroids on (a sample of) the keys and bucket all of them.
+        :param keys: matrix of all stored keys, row i is item i
+        :param max_train_size: at most this many vectors per centroid are used for k-means
+        """
+        sample = keys
+        if len(keys) > max_train_size * self.nlist:
+            rng = np.random.default_rng(self.seed)
+            sample = keys[rng.choice(len(keys), max_train_size * self.nlist, replace=False)]
+        self.centroids = kmeans(np.asarray(sample, dtype=np.float32), self.nlist, seed=self.seed)
+        self.lists = [[] for _ in range(self.nlist)]
+        self.add(0, keys)
+
+    def add(self, start: int, keys: np.ndarray):
+        """
+        Bucket new keys; the centroids are not updated.
+        :param start: row id of the first key
+        :param keys: matrix of the new keys
+        """
+        for row, bucket in enumerate(nearest_centroid(np.asarray(keys, dtype=np.float32), self.centroids), start):
+            self.lists[bucket].append(row)
+
+    def probe(self, centroid_scores: np.ndarray, largest: bool, nprobe: int = None) -> np.ndarray:
+        """
+        Row ids in the buckets whose centroids score best.
+        :param centroid_scores: score of the query against every centroid
+        :param largest: True if larger scores are better (similarities), False for distances
+        :param nprobe: number of buckets to scan, defaults to self.nprobe
+        :return: Array of candidate row ids.
+        """
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        order = np.argsort(-centroid_scores if largest else centroid_scores)[:nprobe]
+        candidates = [self.lists[bucket] for bucket in order if self.lists[bucket]]
+        if not candidates:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.asarray(rows, dtype=np.int64) for rows in candidates])
+
+    def to_arrays(self):
+        """
+        The bucket contents as (ids, offsets): bucket b holds ids[offsets[b]:offsets[b + 1]].
+        """
+        offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(rows) for rows in self.lists])
+        ids = np.fromiter((row for rows in self.lists for row in rows), dtype=np.int64, count=offsets[-1])
+        return ids, offsets
+
+    def from_arrays(self, centroids: np.ndarray, ids: np.ndarray, offsets: np.ndarray):
+        """
+        Restore the state written by to_arrays().
+        """
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.lists = [ids[offsets[b]:offsets[b + 1]].tolist() for b in range(self.nlist)]
@@ -1,17 +1,136 @@
-from typing import Literal, List, Any
+from typing import Literal, List, Any, Tuple
+import json
+import os
+import shutil
+import time
 import numpy as np
+from vanilla_kb.ivf import IVFIndex
+from vanilla_kb.pq import ProductQuantizer
 
 Vec = List
 Val = Any
 
+Metric = Literal['l2', 'cos', 'ip']
+METRICS = ('l2', 'cos', 'ip')
+
+def _score_keys(queries: np.ndarray, keys: np.ndarray, norms: np.ndarray, metric: Metric) -> np.ndarray:
+    """
+    Score keys against each query with a single matrix product.
+    :param queries: float32 matrix of shape (Q, dim)
+    :param keys: float32 matrix of shape (N, dim)
+    :param norms: L2 norms of the keys
+    :param metric: Similarity metric to use.
+    :return: Similarities (cos, ip) or distances (l2) of shape (Q, N).
+    """
+    dots = queries @ keys.T
+    if metric == 'ip':
+        return dots
+    query_norms = np.linalg.norm(queries, axis=1, keepdims=True)
+    if metric == 'cos':
+        return dots / (norms * query_norms)
+    # |a - b|^2 = |a|^2 - 2 a.b + |b|^2, clipped since rounding can make it slightly negative
+    sq_dists = norms * norms - 2 * dots + query_norms * query_norms
+    return np.sqrt(np.maximum(sq_dists, 0))
+
 class KnowledgeBase:
-    def __init__(self, dim: int):
+    def __init__(
+        self, dim: int, capacity: int = 1024,
+        index: Literal['flat', 'ivf'] = 'flat', nlist: int = 64, nprobe: int = 8,
+        storage: Literal['float32', 'float16', 'pq'] = 'float32', pq_m: int = 96, rerank: int = 4
+    ):
         """
         Initialize a knowledge base with a given dimensionality.
         :param dim: the dimensionality of the vectors to be stored
+        :param capacity: number of rows to preallocate; the key matrix doubles when full
+        :param index: 'flat' scans every key exactly; 'ivf' only scans the keys in the nprobe
+            k-means buckets closest to the query (approximate, see vanilla_kb/ivf.py)
+        :param nlist: number of k-means buckets for the 'ivf' index
+        :param nprobe: number of buckets scanned per query for the 'ivf' index
+        :param storage: representation that queries scan. 'float16' halves it; 'pq' encodes each key
+            in pq_m bytes with a product quantizer (see vanilla_kb/pq.py). The float32 keys are kept
+            for re-ranking; after save() and load(mmap=True) they stay on disk.
+        :param pq_m: number of subvectors (bytes per key) for 'pq' storage; must divide dim
+        :param rerank: with compressed storage, the best k * rerank candidates are re-scored exactly
+            against the float32 keys; 0 returns the approximate scores as they are
         """
+        if index not in ('flat', 'ivf'):
+            raise ValueError(f"unknown index {index}")
+        if storage not in ('float32', 'float16', 'pq'):
+            raise ValueError(f"unknown storage {storage}")
         self.dim = dim
-        self.store = []
+        self.vals = []
+        self.ivf = IVFIndex(nlist, nprobe) if index == 'ivf' else None
+        self.storage = storage
+        self.pq = ProductQuantizer(dim, pq_m) if storage == 'pq' else None
+        self.rerank = rerank
+        capacity = max(capacity, 1)
+        # keys live in one contiguous float32 matrix so that a query is a single matrix-vector product
+        self._keys = np.empty((capacity, dim), dtype=np.float32)
+        self._norms = np.empty(capacity, dtype=np.float32)
+        self._compressed = self._empty_compressed(capacity)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def keys(self) -> np.ndarray:
+        """
+        View of the stored keys, one row per item.
+        """
+        return self._keys[:self._size]
+
+    @property
+    def store(self) -> List[tuple]:
+        """
+        The (key, value) pairs in insertion order, as exposed by earlier versions of this class.
+        """
+        return list(zip(self.keys, self.vals))
+
+    def __setstate__(self, state: dict):
+        # indexes pickled before the matrix layout only carry a list of (key, value) tuples
+        if 'store' in state:
+            store = state.pop('store')
+            self.__init__(state['dim'], capacity=len(store))
+            for key, val in store:
+                self.add_item(key, val)
+        else:
+            # matrix-layout pickles from before the IVF index and compressed storage lack those attributes
+            self.ivf, self.storage, self.pq, self._compressed, self.rerank = None, 'float32', None, None, 4
+            self.__dict__.update(state)
+
+    def _empty_compressed(self, capacity: int):
+        """
+        Uninitialised compressed rows for the configured storage, or None for 'float32'.
+        """
+        if self.storage == 'float16':
+            return np.empty((capacity, self.dim), dtype=np.float16)
+        if self.storage == 'pq':
+            return np.empty((capacity, self.pq.m), dtype=np.uint8)
+        return None
+
+    def _reserve(self, n: int):
+        """
+        Make room for n more rows, growing the key matrix by amortized doubling.
+        :param n: number of rows about to be added
+        """
+        needed = self._size + n
+        capacity = self._keys.shape[0]
+        # a memory-mapped index is read-only, so the first write copies it into memory
+        if needed <= capacity and self._keys.flags.writeable and \
+                (self._compressed is None or self._compressed.flags.writeable):
+            return
+        capacity = max(capacity, 1)
+        while capacity < needed:
+            capacity *= 2
+        keys = np.empty((capacity, self.dim), dtype=np.float32)
+        norms = np.empty(capacity, dtype=np.float32)
+        keys[:self._size] = self._keys[:self._size]
+        norms[:self._size] = self._norms[:self._size]
+        compressed = self._empty_compressed(capacity)
+        if compressed is not None:
+            compressed[:self._size] = self._compressed[:self._size]
+        self._keys, self._norms, self._compressed = keys, norms, compressed
 
     def add_item(self, key: Vec, val: Val):
         """
@@ -21,10 +140,158 @@ class KnowledgeBase:
         """
         if len(key) != self.dim:
             raise ValueError(f"len of keys must be {self.dim}, was given {len(key)}")
-        self.store.append((key, val))
+        self.add_items(np.asarray(key, dtype=np.float32)[None, :], [val])
+
+    def add_items(self, keys: np.ndarray, vals: List[Val]):
+        """
+        Store many key-value pairs at once, copying the keys in as a single block.
+        :param keys: Matrix of shape (n, dim), one key per row.
+        :param vals: List of n values, aligned with the rows of keys.
+        """
+        keys = np.asarray(keys, dtype=np.float32)
+        if keys.ndim != 2 or keys.shape[1] != self.dim:
+            raise ValueError(f"keys must have shape (n, {self.dim}), was given {keys.shape}")
+        if len(keys) != len(vals):
+            raise ValueError(f"got {len(keys)} keys but {len(vals)} values")
+        self._reserve(len(keys))
+        end = self._size + len(keys)
+        self._keys[self._size:end] = keys
+        self._norms[self._size:end] = np.linalg.norm(keys, axis=1)
+        if self.storage == 'float16':
+            self._compressed[self._size:end] = keys
+        elif self.storage == 'pq' and self.pq.is_trained:
+            self._compressed[self._size:end] = self.pq.encode(keys)
+        if self.ivf is not None and self.ivf.is_trained:
+            self.ivf.add(self._size, keys)
+        self.vals.extend(vals)
+        self._size = end
+
+    def train(self):
+        """
+        Fit the k-means buckets of the 'ivf' index and the codebooks of 'pq' storage on the keys stored so far.
+        Happens automatically on the first query once enough keys are stored; later keys
+        are added to the existing buckets and encoded with the existing codebooks.
+        """
+        if self.ivf is None and self.pq is None:
+            raise ValueError("only an 'ivf' index or 'pq' storage can be trained")
+        if self.ivf is not None:
+            self.ivf.train(self.keys)
+        if self.pq is not None:
+            self.pq.train(self.keys)
+            self._reserve(0)
+            self._compressed[:self._size] = self.pq.encode(self.keys)
+
+    def _maybe_train(self):
+        """
+        Train whatever is untrained once enough keys have been stored; until then the exact scan is used.
+        """
+        if self.ivf is not None and not self.ivf.is_trained and self._size >= self.ivf.min_train_size:
+            self.ivf.train(self.keys)
+        if self.pq is not None and not self.pq.is_trained and self._size >= self.pq.min_train_size:
+            self.pq.train(self.keys)
+            self._reserve(0)
+            self._compressed[:self._size] = self.pq.encode(self.keys)
+
+    def save(self, path: str):
+        """
+        Write the knowledge base to a directory without pickling.
+        The keys and their norms are stored as float32 .npy files and the values in a JSON sidecar.
+        The files are written to a new versioned directory (path.v<timestamp>) and the path symlink is then
+        atomically repointed at it, so that a process loading or mapping path never sees a half-written or mixed
+        index. The previous version is kept for processes still reading it; older ones are removed.
+        :param path: symlink to write to; an existing plain directory written before versioning is moved aside once
+        """
+        path = path.rstrip(os.sep)
+        version_dir = f"{path}.v{time.time_ns()}"
+        self._write(version_dir)
+
+        tmp_link = f"{path}.tmp-{os.getpid()}"
+        os.symlink(os.path.basename(version_dir), tmp_link)
+        if os.path.isdir(path) and not os.path.islink(path):
+            os.rename(path, f"{path}.v0")
+        os.replace(tmp_link, path)
+
+        parent = os.path.dirname(path) or '.'
+        prefix = os.path.basename(path) + ".v"
+        versions = sorted((name for name in os.listdir(parent) if name.startswith(prefix)),
+                          key=lambda name: int(name[len(prefix):]))
+        for name in versions[:-2]:
+            shutil.rmtree(os.path.join(parent, name))
+
+    def _write(self, path: str):
+        os.makedirs(path)
+        np.save(os.path.join(path, "keys.npy"), np.ascontiguousarray(self.keys), allow_pickle=False)
+        np.save(os.path.join(path, "norms.npy"), self._norms[:self._size], allow_pickle=False)
+        meta = {"dim": self.dim, "size": self._size, "vals": self.vals, "index": {"type": "flat"},
+                "storage": {"type": self.storage, "rerank": self.rerank}}
+        if self.storage == 'float16':
+            np.save(os.path.join(path, "keys_f16.npy"), self._compressed[:self._size], allow_pickle=False)
+        elif self.storage == 'pq':
+            meta["storage"].update(m=self.pq.m, trained=self.pq.is_trained)
+            if self.pq.is_trained:
+                np.save(os.path.join(path, "pq_codes.npy"), self._compressed[:self._size], allow_pickle=False)
+                np.save(os.path.join(path, "pq_codebooks.npy"), self.pq.codebooks, allow_pickle=False)
+        if self.ivf is not None:
+            meta["index"] = {"type": "ivf", "nlist": self.ivf.nlist, "nprobe": self.ivf.nprobe,
+                             "trained": self.ivf.is_trained}
+            if self.ivf.is_trained:
+                ids, offsets = self.ivf.to_arrays()
+                np.save(os.path.join(path, "ivf_centroids.npy"), self.ivf.centroids, allow_pickle=False)
+                np.save(os.path.join(path, "ivf_ids.npy"), ids, allow_pickle=False)
+                np.save(os.path.join(path, "ivf_offsets.npy"), offsets, allow_pickle=False)
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "KnowledgeBase":
+        """
+        Load a knowledge base written by save().
+        :param path: directory written by save()
+        :param mmap: map the key files read-only instead of reading them, so that several processes share their
+            pages; with compressed storage only the rows re-ranked by a query are read from the float32 keys
+        :return: The loaded knowledge base.
+        """
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        mmap_mode = "r" if mmap else None
+        keys = np.load(os.path.join(path, "keys.npy"), mmap_mode=mmap_mode, allow_pickle=False)
+        norms = np.load(os.path.join(path, "norms.npy"), allow_pickle=False)
+        if keys.shape != (meta["size"], meta["dim"]) or len(norms) != meta["size"]:
+            raise ValueError(f"index files in {path} do not match its meta.json")
+
+        kb = cls.__new__(cls)
+        kb.dim = meta["dim"]
+        kb.vals = meta["vals"]
+        kb._keys = keys
+        kb._norms = norms
+        kb._size = meta["size"]
+        kb.ivf = None
+        storage = meta.get("storage", {"type": "float32", "rerank": 4})
+        kb.storage = storage["type"]
+        kb.rerank = storage["rerank"]
+        kb.pq = None
+        kb._compressed = None
+        if kb.storage == 'float16':
+            kb._compressed = np.load(os.path.join(path, "keys_f16.npy"), mmap_mode=mmap_mode, allow_pickle=False)
+        elif kb.storage == 'pq':
+            kb.pq = ProductQuantizer(kb.dim, storage["m"])
+            if storage["trained"]:
+                kb.pq.codebooks = np.load(os.path.join(path, "pq_codebooks.npy"), allow_pickle=False)
+                kb._compressed = np.load(os.path.join(path, "pq_codes.npy"), mmap_mode=mmap_mode, allow_pickle=False)
+            else:
+                kb._compressed = kb._empty_compressed(kb._size)
+        index = meta.get("index", {"type": "flat"})
+        if index["type"] == "ivf":
+            kb.ivf = IVFIndex(index["nlist"], index["nprobe"])
+            if index["trained"]:
+                kb.ivf.from_arrays(*(
+                    np.load(os.path.join(path, f"ivf_{name}.npy"), allow_pickle=False)
+                    for name in ("centroids", "ids", "offsets")
+                ))
+        return kb
 
     def retrieve(
-        self, key: Vec, metric: Literal['l2', 'cos', 'ip'], k: int = 1
+        self, key: Vec, metric: Metric, k: int = 1
     ) -> List[Val]:
         """
         Retrieve the top k values from the knowledge base given a key and similarity metric.
@@ -33,54 +300,151 @@ class KnowledgeBase:
         :param k: Top k similar items to retrieve.
         :return: List of top k similar values.
         """
-        # sort the whole persistent structure and return the top k
-        similarities = []
-        for item_key, val in self.store:
-          if metric == 'l2':
-              similarities.append((self._sim_euclidean(key, item_key), val))
-          elif metric == 'cos':
-              similarities.append((self._sim_cosine(key, item_key), val))
-          elif metric == 'ip':
-              similarities.append((self._sim_inner_product(key, item_key), val))
-          else:
-              raise ValueError(f"unknown metric {metric}")
-
-        # asc for similarity, desc for distance
-        if metric in ['cos', 'ip']:
-            similarities.sort(reverse=True, key=lambda x: x[0])
-        else:
-            similarities.sort(reverse=False, key=lambda x: x[0])
+        if metric not in METRICS:
+            raise ValueError(f"unknown metric {metric}")
+        if len(key) != self.dim:
+            raise ValueError(f"len of keys must be {self.dim}, was given {len(key)}")
+        if self._size == 0 or k <= 0:
+            return []
 
-        # return the top k values
-        return [val for _, val in similarities[:k]]
+        self._maybe_train()
+        rows, _ = self._search(np.asarray(key, dtype=np.float32), metric, k)
+        return [self.vals[i] for i in rows]
 
-    @staticmethod
-    def _sim_euclidean(a: Vec, b: Vec) -> float:
+    def retrieve_batch(
+        self, queries: np.ndarray, metric: Metric, k: int = 1, block_size: int = 256
+    ) -> Tuple[np.ndarray, np.ndarray]:
         """
-        Compute Euclidean (L2) distance between two vectors.
-        :param a: Vector a
-        :param b: Vector b
-        :return: Similarity score
+        Retrieve the top k items for many queries at once.
+        The Q x N score matrix is computed block_size queries at a time so memory stays bounded.
+        :param queries: Matrix of shape (Q, dim), one query per row.
+        :param metric: Similarity metric to use.
+        :param k: Top k similar items to retrieve per query.
+        :param block_size: Number of queries scored per matrix product.
+        :return: (indices, scores), both of shape (Q, min(k, N)), best first per row.
+            Indices are positions in self.vals; scores are distances for 'l2' and similarities otherwise.
+            With the 'ivf' index a row can have fewer candidates than k; it is padded with index -1 and score nan.
+            Only the exact float32 flat scan is blocked; other configurations search query by query.
         """
-        return np.linalg.norm(np.array(a) - np.array(b))
+        if metric not in METRICS:
+            raise ValueError(f"unknown metric {metric}")
+        queries = np.asarray(queries, dtype=np.float32)
+        if queries.ndim != 2 or queries.shape[1] != self.dim:
+            raise ValueError(f"queries must have shape (Q, {self.dim}), was given {queries.shape}")
 
-    @staticmethod
-    def _sim_cosine(a: Vec, b: Vec) -> float:
+        n_out = max(min(k, self._size), 0)
+        indices = np.empty((len(queries), n_out), dtype=np.int64)
+        scores = np.empty((len(queries), n_out), dtype=np.float32)
+        if n_out == 0:
+            return indices, scores
+
+        self._maybe_train()
+        if self.ivf is not None and self.ivf.is_trained or not self._scans_exact():
+            indices.fill(-1)
+            scores.fill(np.nan)
+            for i, query in enumerate(queries):
+                rows, row_scores = self._search(query, metric, k)
+                indices[i, :len(rows)] = rows
+                scores[i, :len(rows)] = row_scores
+            return indices, scores
+
+        for start in range(0, len(queries), block_size):
+            block_scores = self._score(queries[start:start + block_size], metric)
+            top = self._top_k(block_scores, k, largest=metric != 'l2')
+            indices[start:start + block_size] = top
+            scores[start:start + block_size] = np.take_along_axis(block_scores, top, axis=-1)
+        return indices, scores
+
+    def _score(self, queries: np.ndarray, metric: Metric) -> np.ndarray:
+        """
+        Score every stored key against each query with a single matrix product.
+        :param queries: float32 matrix of shape (Q, dim)
+        :param metric: Similarity metric to use.
+        :return: Similarities (cos, ip) or distances (l2) of shape (Q, N).
+        """
+        return _score_keys(queries, self.keys, self._norms[:self._size], metric)
+
+    def _scans_exact(self) -> bool:
+        """
+        Whether the scanned representation is the float32 keys themselves (also 'pq' storage before training).
         """
-        Compute the cosine similarity between two vectors.
-        :param a: Vector a
-        :param b: Vector b
-        :return: Similarity score
+        return self.storage == 'float32' or (self.storage == 'pq' and not self.pq.is_trained)
+
+    def _scan(self, query: np.ndarray, metric: Metric, rows: np.ndarray = None, block_size: int = 16384) -> np.ndarray:
+        """
+        Score the query against the scanned representation of the given rows (all rows if None).
+        :param query: float32 query vector of length dim
+        :param metric: Similarity metric to use.
+        :param rows: row ids to score
+        :param block_size: rows of float16 keys converted to float32 at a time
+        :return: Scores per row; approximate unless self._scans_exact().
         """
-        a, b = np.array(a), np.array(b)
-        return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+        norms = self._norms[:self._size] if rows is None else self._norms[rows]
+        if self._scans_exact():
+            keys = self.keys if rows is None else self._keys[rows]
+            return _score_keys(query[None, :], keys, norms, metric)[0]
+
+        compressed = self._compressed[:self._size] if rows is None else self._compressed[rows]
+        if self.storage == 'float16':
+            # numpy has no float16 BLAS, so convert a block at a time and score it in float32
+            return np.concatenate([
+                _score_keys(query[None, :], compressed[i:i + block_size].astype(np.float32),
+                            norms[i:i + block_size], metric)[0]
+                for i in range(0, len(compressed), block_size)
+            ])
+        scores = self.pq.scan(self.pq.distance_tables(query, metric), compressed)
+        if metric == 'l2':
+            return np.sqrt(np.maximum(scores, 0))
+        if metric == 'cos':
+            return scores / (norms * np.linalg.norm(query))
+        return scores
+
+    def _search(self, query: np.ndarray, metric: Metric, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top k rows for a single query: probe the 'ivf' buckets if trained, scan the stored
+        representation, and re-rank the best candidates against the float32 keys if it is compressed.
+        :param query: float32 query vector of length dim
+        :param metric: Similarity metric to use.
+        :param k: number of items to return
+        :return: (rows, scores) of at most k items, best first.
+        """
+        largest = metric != 'l2'
+        rows = None
+        if self.ivf is not None and self.ivf.is_trained:
+            centroids = self.ivf.centroids
+            centroid_scores = _score_keys(query[None, :], centroids, np.linalg.norm(centroids, axis=1), metric)[0]
+            rows = self.ivf.probe(centroid_scores, largest)
+            if len(rows) == 0:
+                return rows, np.empty(0, dtype=np.float32)
+
+        scores = self._scan(query, metric, rows)
+        rerank = not self._scans_exact() and self.rerank > 0
+        top = self._top_k(scores, k * self.rerank if rerank else k, largest)
+        candidates, scores = (top if rows is None else rows[top]), scores[top]
+        if not rerank:
+            return candidates, scores
+
+        # re-rank in row order so that a memory-mapped key file is read front to back
+        candidates = np.sort(candidates)
+        exact = _score_keys(query[None, :], self._keys[candidates], self._norms[candidates], metric)[0]
+        top = self._top_k(exact, k, largest)
+        return candidates[top], exact[top]
 
     @staticmethod
-    def _sim_inner_product(a: Vec, b: Vec) -> float:
+    def _top_k(scores: np.ndarray, k: int, largest: bool) -> np.ndarray:
         """
-        Compute the inner product between two vectors.
-        :param a: Vector a
-        :param b: Vector b
-        :return: Similarity score
+        Indices of the k best scores along the last axis, best first, without sorting the whole array.
+        :param scores: array of scores, 1-d or one row per query
+        :param k: number of indices to return
+        :param largest: True if larger scores are better (similarities), False for distances
+        :return: Array of at most k indices per row.
         """
-        return np.dot(np.array(a), np.array(b))
+        if largest:
+            scores = -scores
+        n = scores.shape[-1]
+        if k < n:
+            top = np.argpartition(scores, k - 1, axis=-1)[..., :k]
+        else:
+            top = np.broadcast_to(np.arange(n), scores.shape)
+        order = np.argsort(np.take_along_axis(scores, top, axis=-1), axis=-1, kind='stable')
+        return np.take_along_axis(top, order, axis=-1)
@@ -0,0 +1,88 @@
+import numpy as np
+from vanilla_kb.ivf import kmeans, nearest_centroid
+
+class ProductQuantizer:
+    def __init__(self, dim: int, m: int = 96, n_centroids: int = 256, seed: int = 0):
+        """
+        Product quantizer: a vector is split into m subvectors and each one is replaced by the
+        index of its nearest centroid in a per-subspace codebook, i.e. one byte per subvector.
+        :param dim: the dimensionality of the vectors; must be divisible by m
+        :param m: number of subvectors (bytes per encoded vector)
+        :param n_centroids: codebook size per subspace, at most 256 so codes fit in uint8
+        :param seed: seed for k-means
+        """
+        if dim % m != 0:
+            raise ValueError(f"dim {dim} is not divisible by m={m}")
+        if not 1 <= n_centroids <= 256:
+            raise ValueError(f"n_centroids must be between 1 and 256, was given {n_centroids}")
+        self.dim = dim
+        self.m = m
+        self.dsub = dim // m
+        self.n_centroids = n_centroids
+        self.seed = seed
+        self.codebooks = None
+
+    @property
+    def is_trained(self) -> bool:
+        return self.codebooks is not None
+
+    @property
+    def min_train_size(self) -> int:
+        """
+        Number of vectors to collect before training automatically (about 39 per centroid).
+        """
+        return 39 * self.n_centroids
+
+    def _split(self, data: np.ndarray) -> np.ndarray:
+        return np.asarray(data, dtype=np.float32).reshape(len(data), self.m, self.dsub)
+
+    def train(self, data: np.ndarray, max_train_size: int = 65536):
+        """
+        Fit one k-means codebook per subspace on (a sample of) the data.
+        :param data: matrix of shape (n, dim), n >= n_centroids
+        :param max_train_size: at most this many vectors are used
+        """
+        if len(data) > max_train_size:
+            rng = np.random.default_rng(self.seed)
+            data = data[rng.choice(len(data), max_train_size, replace=False)]
+        sub = self._split(data)
+        self.codebooks = np.stack([
+            kmeans(np.ascontiguousarray(sub[:, j]), self.n_centroids, seed=self.seed + j)
+            for j in range(self.m)
+        ])
+
+    def encode(self, data: np.ndarray) -> np.ndarray:
+        """
+        :param data: matrix of shape (n, dim)
+        :return: uint8 codes of shape (n, m).
+        """
+        sub = self._split(data)
+        codes = np.empty((len(data), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = nearest_centroid(np.ascontiguousarray(sub[:, j]), self.codebooks[j])
+        return codes
+
+    def distance_tables(self, query: np.ndarray, metric: str) -> np.ndarray:
+        """
+        Per-subspace partial scores of the (uncompressed) query against every codebook entry.
+        Summing one entry per subspace gives the asymmetric distance to an encoded vector.
+        :param query: float32 query vector of length dim
+        :param metric: 'l2' gives squared distances, 'cos' and 'ip' give inner products
+        :return: Table of shape (m, n_centroids).
+        """
+        sub = query.reshape(self.m, 1, self.dsub)
+        if metric == 'l2':
+            return ((self.codebooks - sub) ** 2).sum(axis=2)
+        return (self.codebooks * sub).sum(axis=2)
+
+    def scan(self, tables: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """
+        Asymmetric distance computation: look up and sum the table entries selected by each code.
+        :param tables: output of distance_tables()
+        :param codes: uint8 codes of shape (n, m)
+        :return: One summed score per code row.
+        """
+        scores = np.zeros(len(codes), dtype=np.float32)
+        for j in range(self.m):
+            scores += tables[j][codes[:, j]]
+        return scores
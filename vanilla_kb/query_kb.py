@@ -1,19 +1,28 @@
-from sentence_transformers import SentenceTransformer
-import pickle
+from vanilla_kb.embedding import load_model
+from vanilla_kb.knowledge_base import KnowledgeBase
 import vanilla_kb.passages as passages
 
 # Load the saved knowledge base
-with open('vanilla_kb/kb_index_embd.pkl', 'rb') as f:
-    kb_index_embd = pickle.load(f)
+kb_index_embd = KnowledgeBase.load('vanilla_kb/kb_index_embd', mmap=True)
 
 # Initialize the sentence transformer model for querying
-model_embd = SentenceTransformer("bert-base-nli-mean-tokens").to("cuda:0")
+model_embd = load_model()
 
 def get_embd_passages(question, metric='cos', top_k=5):
     query_vector = model_embd.encode(question).squeeze()
     top_indices = kb_index_embd.retrieve(query_vector, metric, k=top_k)
     return [passages.passages[i]['content'] for i in top_indices]
 
+def get_embd_passages_batch(questions, metric='cos', top_k=5, batch_size=64):
+    # one encode call for all questions, then one blocked scan of the knowledge base; rows of -1 pad the
+    # results of an IVF index that found fewer than top_k candidates
+    query_vectors = model_embd.encode(questions, batch_size=batch_size)
+    top_rows, _ = kb_index_embd.retrieve_batch(query_vectors, metric, k=top_k)
+    return [
+        [passages.passages[kb_index_embd.vals[row]]['content'] for row in rows if row >= 0]
+        for rows in top_rows
+    ]
+
 # Example usage
 if __name__ == "__main__":
     question = "What are the challenges of digital democracy?"